@@ -0,0 +1,93 @@
+import asyncio
+import collections
+
+
+class Overloaded(Exception):
+    """Raised when an upstream call cannot be admitted (queue full or queue wait expired)"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Caps concurrent upstream LLM calls on one event loop.
+
+    Up to ``limit`` calls run at once. Further callers wait in a FIFO queue
+    of at most ``max_queue`` entries for up to ``queue_timeout`` seconds;
+    anything beyond that is rejected immediately with ``Overloaded`` so the
+    server can answer 503 instead of piling up requests. Released slots are
+    handed directly to the oldest waiter.
+
+    Not thread-safe: use it from coroutines on a single event loop.
+    """
+
+    def __init__(self, limit=256, max_queue=512, queue_timeout=2.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiters = collections.deque()
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+
+    async def acquire(self):
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("Too many upstream calls in flight")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except BaseException:
+            # Caller cancelled: give back a slot that was already handed over
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self.queue_timeouts += 1
+            self.rejected += 1
+            raise Overloaded("Timed out waiting for an upstream slot")
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the waiter; in-flight count is unchanged
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self._in_flight,
+            'waiting': len(self._waiters),
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'queue_timeouts': self.queue_timeouts,
+        }
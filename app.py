@@ -1,21 +1,48 @@
-from flask import Flask, render_template, request, jsonify
-import google.generativeai as genai
+from flask import Flask, Response, g, render_template, request, jsonify
+import atexit
+import json
+import math
 import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from datetime import datetime
 
+from circuit_breaker import CircuitBreakers, CircuitOpen, DeadlineExceeded, backoff_delay
+from llm_backend import create_backend, is_availability_error, is_retryable_error
+from model_registry import ModelRegistry
+from dense_retrieval import HashingEmbedder, fuse_scores
+from knowledge_store import KnowledgeStore
+from response_cache import ResponseCache, create_cache_backend, make_cache_key, normalize_query
+from semantic_cache import SemanticCache
+from single_flight import FileResultStore, SingleFlight
+from context_builder import build_context
+from query_log import QueryLogger, annotate, start_request_fields, stop_request_fields
+from metrics import (REGISTRY, CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED, FALLBACKS, LLM_RETRIES, PROMPT_SIZE,
+                     REQUEST_LATENCY, RETRIEVED_DOCUMENTS, STAGE_ERRORS, instrumented, iterate_with_context,
+                     server_timing_header, start_request_timing, stop_request_timing, submit_with_context)
+
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
+app = Flask(__name__, template_folder='template')
 
 # Configure your Gemini API key from environment variable
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-if not GEMINI_API_KEY:
+# LLM backend: 'gemini' (default) or 'fake' for offline benchmarks and load tests
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+
+if not GEMINI_API_KEY and LLM_BACKEND == 'gemini':
     print("⚠️  WARNING: GEMINI_API_KEY not found in environment variables")
     print("Please create a .env file with your API key")
 
+llm_backend = create_backend(LLM_BACKEND, api_key=GEMINI_API_KEY,
+                             latency=float(os.getenv('FAKE_LLM_LATENCY', '0.5')),
+                             jitter=float(os.getenv('FAKE_LLM_JITTER', '0.1')),
+                             failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0.0')))
+
 # Comprehensive Company Knowledge Base
 COMPANY_KNOWLEDGE_BASE = {
     # Company Basic Information
@@ -150,161 +177,340 @@ COMPANY_KNOWLEDGE_BASE = {
     }
 }
 
+# Candidate models, best first. The registry resolves one at startup and keeps
+# it cached so requests never pay for a probe round-trip.
+MODEL_CANDIDATES = ['gemini-2.5-flash', 'gemini-1.5-flash']
+MODEL_CACHE_TTL = int(os.getenv('MODEL_CACHE_TTL', '300'))
+MODEL_UNHEALTHY_COOLDOWN = int(os.getenv('MODEL_UNHEALTHY_COOLDOWN', '60'))
+
+# Every upstream call gets a per-attempt timeout; failed attempts are retried
+# with jittered backoff while the request deadline allows. A breaker per model
+# trips on error rate or slow calls and sends requests to the fallback answer.
+LLM_CALL_TIMEOUT = float(os.getenv('LLM_CALL_TIMEOUT', '15'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.2'))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '2'))
+
+circuit_breakers = CircuitBreakers(window=int(os.getenv('BREAKER_WINDOW', '20')),
+                                   min_calls=int(os.getenv('BREAKER_MIN_CALLS', '5')),
+                                   error_rate=float(os.getenv('BREAKER_ERROR_RATE', '0.5')),
+                                   slow_call_seconds=float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '10')),
+                                   slow_rate=float(os.getenv('BREAKER_SLOW_RATE', '0.8')),
+                                   open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '30')))
+
+model_registry = ModelRegistry(MODEL_CANDIDATES, lambda name: llm_backend.probe(name, timeout=LLM_CALL_TIMEOUT),
+                               ttl=MODEL_CACHE_TTL,
+                               unhealthy_cooldown=MODEL_UNHEALTHY_COOLDOWN)
+
+if llm_backend.configured:
+    model_registry.start()
+
+@instrumented('api_key_check')
 def test_api_key():
-    """Test if the API key is valid"""
-    try:
-        if not GEMINI_API_KEY:
-            return False, "API key not found in environment variables"
-        
-        genai.configure(api_key=GEMINI_API_KEY)
-        # Try gemini-2.0-flash-exp as it's the latest available model
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content("Say 'API test successful'")
-            return True, "API key is valid - Using gemini-2.5-flash"
-        except Exception as model_error:
-            # Fallback to gemini-1.5-flash if 2.0 is not available
-            try:
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content("Say 'API test successful'")
-                return True, "API key is valid - Using gemini-1.5-flash (2.0 not available)"
-            except Exception:
-                return False, f"Model error: {str(model_error)}"
-                
-    except Exception as e:
-        return False, f"API key error: {str(e)}"
+    """Report whether the API key and a model are usable (cached, no network call)"""
+    if not llm_backend.configured:
+        return False, "API key not found in environment variables"
+    return model_registry.status()
 
-def get_available_model():
-    """Get the best available model"""
-    try:
-        # Try the latest model first
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        # Test if model is available
-        test_response = model.generate_content("test")
-        return 'gemini-2.5-flash'
-    except Exception:
-        try:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            test_response = model.generate_content("test")
-            return 'gemini-1.5-flash'
-        except Exception:
-            return None
+@instrumented('model_resolution')
+def get_available_model(replaces_probe=True):
+    """Get the best available model from the registry cache"""
+    if not llm_backend.configured:
+        return None
+    model_name = model_registry.get_model(replaces_probe)
+    annotate(model=model_name)
+    return model_name
 
-def retrieve_relevant_info(query):
+def report_model_error(model_name, error):
+    """Demote ``model_name`` only if ``error`` says the model is unavailable.
+
+    Request-specific failures (e.g. a safety-blocked answer) stay a
+    per-request error and must not take the model away from everyone.
     """
-    Enhanced retrieval with comprehensive keyword mappings
+    if model_name and is_availability_error(error):
+        model_registry.mark_unhealthy(model_name, error)
+
+# Keyword mappings: category -> trigger phrases. These are indexed once as
+# synonym boosts for the matching knowledge base document.
+KEYWORD_MAPPINGS = {
+    'company': ['company overview', 'about company', 'what is techcorp', 'who we are', 'company info'],
+    'founders': ['founders', 'ceo', 'cto', 'sarah chen', 'mark rodriguez', 'leadership'],
+    'mission': ['mission', 'vision', 'values', 'purpose', 'why we exist'],
+    'products': ['what we do', 'products', 'services', 'offerings', 'platform'],
+    'size': ['company size', 'employees', 'team size', 'how many people'],
+    'achievements': ['achievements', 'milestones', 'awards', 'funding', 'success'],
+    'culture': ['company culture', 'work environment', 'values', 'work life'],
+    'vacation': ['vacation policy', 'time off', 'pto', 'holiday', 'days off'],
+    'remote': ['remote work policy', 'wfh', 'work from home', 'hybrid', 'remote'],
+    'insurance': ['health insurance', 'benefits', 'medical', 'dental', 'insurance'],
+    'pricing': ['product pricing', 'cost', 'price', 'subscription', 'how much'],
+    'features': ['new features', 'product updates', 'launch', 'roadmap', 'whats new'],
+    'expense': ['expense reimbursement', 'expenses', 'reimbursement', 'expense'],
+    'review': ['performance reviews', 'performance', 'feedback', 'review'],
+    'contact': ['key contacts', 'who to contact', 'support', 'hr', 'contact'],
+    'event': ['company events', 'meetings', 'party', 'all-hands', 'events'],
+    'departments': ['departments', 'teams', 'engineering', 'sales', 'marketing'],
+    'career': ['career growth', 'promotion', 'development', 'learning', 'growth'],
+    'diversity': ['diversity', 'inclusion', 'dei', 'equity', 'representation']
+}
+
+# Map keyword categories to actual document names
+CATEGORY_DOCUMENTS = {
+    'company': 'company overview',
+    'founders': 'founders',
+    'mission': 'mission vision',
+    'products': 'what we do',
+    'size': 'company size',
+    'achievements': 'key achievements',
+    'culture': 'company culture',
+    'vacation': 'vacation policy',
+    'remote': 'remote work policy',
+    'insurance': 'health insurance',
+    'pricing': 'product pricing',
+    'features': 'new features',
+    'expense': 'expense reimbursement',
+    'review': 'performance reviews',
+    'contact': 'key contacts',
+    'event': 'company events',
+    'departments': 'departments',
+    'career': 'career growth',
+    'diversity': 'diversity inclusion'
+}
+
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+RETRIEVAL_MIN_SCORE_RATIO = float(os.getenv('RETRIEVAL_MIN_SCORE_RATIO', '0.2'))
+# keyword (BM25), dense (hashed TF-IDF embeddings) or hybrid (both, fused)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'keyword')
+HYBRID_ALPHA = float(os.getenv('HYBRID_ALPHA', '0.5'))
+DENSE_MIN_SCORE = float(os.getenv('DENSE_MIN_SCORE', '0.15'))
+DENSE_DIM = int(os.getenv('DENSE_DIM', '1024'))
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index'))
+DENSE_INDEX_DIR = os.getenv('DENSE_INDEX_DIR', os.path.join(INDEX_DIR, 'dense'))
+# Optional directory of Markdown/JSONL documents replacing the built-in knowledge base
+KNOWLEDGE_BASE_DIR = os.getenv('KNOWLEDGE_BASE_DIR')
+KNOWLEDGE_SNAPSHOT_PATH = os.getenv('KNOWLEDGE_SNAPSHOT_PATH', os.path.join(INDEX_DIR, 'knowledge.pkl'))
+KNOWLEDGE_CHUNK_CHARS = int(os.getenv('KNOWLEDGE_CHUNK_CHARS', '1200'))
+KNOWLEDGE_RELOAD_INTERVAL = int(os.getenv('KNOWLEDGE_RELOAD_INTERVAL', '30'))
+
+def build_knowledge_store(knowledge_base=None):
+    """Load the knowledge base and its retrieval indexes once per process"""
+    synonyms = {CATEGORY_DOCUMENTS[category]: keywords
+                for category, keywords in KEYWORD_MAPPINGS.items()
+                if category in CATEGORY_DOCUMENTS}
+    options = dict(dense_dir=DENSE_INDEX_DIR, synonyms=synonyms,
+                   build_dense=RETRIEVAL_MODE in ('dense', 'hybrid'), dense_dim=DENSE_DIM)
+    if knowledge_base is not None or not KNOWLEDGE_BASE_DIR:
+        return KnowledgeStore.from_dict(knowledge_base or COMPANY_KNOWLEDGE_BASE, **options)
+    store = KnowledgeStore(KNOWLEDGE_BASE_DIR, snapshot_path=KNOWLEDGE_SNAPSHOT_PATH,
+                           chunk_chars=KNOWLEDGE_CHUNK_CHARS, **options)
+    store.load()
+    store.start_watcher(KNOWLEDGE_RELOAD_INTERVAL)
+    return store
+
+knowledge_store = build_knowledge_store()
+
+def rank_documents(query, top_k, mode=None, snapshot=None):
+    """Return ``(doc, score)`` pairs from the configured retriever"""
+    mode = mode or RETRIEVAL_MODE
+    snapshot = snapshot or knowledge_store.current
+    keyword_index, dense_index = snapshot.keyword_index, snapshot.dense_index
+    if mode == 'keyword' or dense_index is None:
+        return keyword_index.search(query, k=top_k, min_score_ratio=RETRIEVAL_MIN_SCORE_RATIO)
+    if mode == 'dense':
+        return dense_index.search(query, k=top_k, min_score=DENSE_MIN_SCORE)
+    keyword_results = keyword_index.search(query, k=top_k * 2)
+    dense_results = dense_index.search(query, k=top_k * 2, min_score=DENSE_MIN_SCORE)
+    fused = fuse_scores(keyword_results, dense_results, alpha=HYBRID_ALPHA, k=top_k)
+    if fused and RETRIEVAL_MIN_SCORE_RATIO:
+        cutoff = fused[0][1] * RETRIEVAL_MIN_SCORE_RATIO
+        fused = [item for item in fused if item[1] >= cutoff]
+    return fused
+
+@instrumented('retrieval')
+def retrieve_relevant_info(query, top_k=None, mode=None, snapshot=None):
+    """
+    Rank knowledge base documents for the query and return the top-k
+    (keyword, dense or hybrid retrieval, see RETRIEVAL_MODE)
     """
-    query_lower = query.lower()
     relevant_info = []
+    snapshot = snapshot or knowledge_store.current
     
-    # Comprehensive keyword mappings
-    keyword_mappings = {
-        'company': ['company overview', 'about company', 'what is techcorp', 'who we are', 'company info'],
-        'founders': ['founders', 'ceo', 'cto', 'sarah chen', 'mark rodriguez', 'leadership'],
-        'mission': ['mission', 'vision', 'values', 'purpose', 'why we exist'],
-        'products': ['what we do', 'products', 'services', 'offerings', 'platform'],
-        'size': ['company size', 'employees', 'team size', 'how many people'],
-        'achievements': ['achievements', 'milestones', 'awards', 'funding', 'success'],
-        'culture': ['company culture', 'work environment', 'values', 'work life'],
-        'vacation': ['vacation policy', 'time off', 'pto', 'holiday', 'days off'],
-        'remote': ['remote work policy', 'wfh', 'work from home', 'hybrid', 'remote'],
-        'insurance': ['health insurance', 'benefits', 'medical', 'dental', 'insurance'],
-        'pricing': ['product pricing', 'cost', 'price', 'subscription', 'how much'],
-        'features': ['new features', 'product updates', 'launch', 'roadmap', 'whats new'],
-        'expense': ['expense reimbursement', 'expenses', 'reimbursement', 'expense'],
-        'review': ['performance reviews', 'performance', 'feedback', 'review'],
-        'contact': ['key contacts', 'who to contact', 'support', 'hr', 'contact'],
-        'event': ['company events', 'meetings', 'party', 'all-hands', 'events'],
-        'departments': ['departments', 'teams', 'engineering', 'sales', 'marketing'],
-        'career': ['career growth', 'promotion', 'development', 'learning', 'growth'],
-        'diversity': ['diversity', 'inclusion', 'dei', 'equity', 'representation']
-    }
-    
-    # Find relevant documents based on keyword mappings
-    matched_docs = set()
-    for category, keywords in keyword_mappings.items():
-        if any(keyword in query_lower for keyword in keywords):
-            # Map to actual document names
-            mapping = {
-                'company': 'company overview',
-                'founders': 'founders',
-                'mission': 'mission vision',
-                'products': 'what we do',
-                'size': 'company size',
-                'achievements': 'key achievements',
-                'culture': 'company culture',
-                'vacation': 'vacation policy',
-                'remote': 'remote work policy',
-                'insurance': 'health insurance',
-                'pricing': 'product pricing',
-                'features': 'new features',
-                'expense': 'expense reimbursement',
-                'review': 'performance reviews',
-                'contact': 'key contacts',
-                'event': 'company events',
-                'departments': 'departments',
-                'career': 'career growth',
-                'diversity': 'diversity inclusion'
-            }
-            if category in mapping:
-                matched_docs.add(mapping[category])
-    
-    # Also do direct matching
-    for key in COMPANY_KNOWLEDGE_BASE.keys():
-        if any(word in query_lower for word in key.split()):
-            matched_docs.add(key)
-    
-    # Convert to list of info objects
-    for doc in matched_docs:
-        if doc in COMPANY_KNOWLEDGE_BASE:
-            info = COMPANY_KNOWLEDGE_BASE[doc]
-            relevant_info.append({
-                "source": f"{info['source']} (Updated: {info['last_updated']})",
-                "content": info['content'],
-                "title": doc.replace('_', ' ').title()
-            })
+    for doc, score in rank_documents(query, top_k or RETRIEVAL_TOP_K, mode, snapshot):
+        info = snapshot.knowledge_base.get(doc)
+        if info is None:
+            continue
+        relevant_info.append({
+            "id": doc,
+            "score": round(score, 3),
+            "source": f"{info['source']} (Updated: {info['last_updated']})",
+            "last_updated": info['last_updated'],
+            "content": info['content'],
+            "title": info['title']
+        })
     
+    RETRIEVED_DOCUMENTS.observe(len(relevant_info))
+    annotate(documents=[info['id'] for info in relevant_info])
     return relevant_info
 
-def format_context_for_prompt(retrieved_info):
-    """Format the retrieved information for the Gemini prompt"""
-    if not retrieved_info:
-        return "No specific company documents found for this query."
-    
-    context_parts = ["RETRIEVED COMPANY KNOWLEDGE:"]
-    
-    for i, info in enumerate(retrieved_info, 1):
-        context_parts.append(f"""
-DOCUMENT {i}: {info['title']}
-SOURCE: {info['source']}
-CONTENT: {info['content']}
-""")
-    
-    return "\n".join(context_parts)
+# Token budget for the retrieved context in the RAG prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', '0.8'))
+
+@instrumented('prompt_format')
+def format_context_for_prompt(retrieved_info, token_budget=None):
+    """Format the retrieved information for the Gemini prompt within the token budget"""
+    result = build_context(retrieved_info,
+                           token_budget=CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget,
+                           dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
+    CONTEXT_TOKENS.observe(result.tokens)
+    CONTEXT_TOKENS_SAVED.observe(result.tokens_saved)
+    return result.text
+
+# Answer cache: 'memory', 'sqlite:///path/to/cache.db' (shared by workers) or 'off'
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+
+response_cache = ResponseCache(create_cache_backend(RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_MAX_ENTRIES),
+                               ttl=RESPONSE_CACHE_TTL)
+
+# Semantic cache: reuse answers for rephrasings with the same content words
+# (word order, stopwords, plurals) over the same documents
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.8'))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv('SEMANTIC_CACHE_CAPACITY', '2048'))
+SEMANTIC_CACHE_DIM = int(os.getenv('SEMANTIC_CACHE_DIM', '2048'))
+
+def fit_semantic_embedder(snapshot):
+    """Query embedder fitted on the knowledge base vocabulary"""
+    texts = [f"{info['title']}. {info['content']}" for info in snapshot.knowledge_base.values()]
+    return HashingEmbedder(SEMANTIC_CACHE_DIM, char_ngrams=False).fit(texts, drop_unseen=True)
+
+def build_semantic_cache():
+    """Semantic cache whose embedder is refitted whenever the knowledge base is re-indexed"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    cache = SemanticCache(capacity=SEMANTIC_CACHE_CAPACITY, threshold=SEMANTIC_CACHE_THRESHOLD,
+                          embedder=fit_semantic_embedder(knowledge_store.current), ttl=RESPONSE_CACHE_TTL)
+    # Vectors from the old embedder are not comparable with the new one, so the rows are dropped
+    knowledge_store.on_swap(lambda snapshot: cache.reset(fit_semantic_embedder(snapshot)))
+    return cache
+
+semantic_cache = build_semantic_cache()
+
+# Single flight: identical questions over the same documents that arrive while
+# one generation is in flight wait for it instead of calling Gemini again.
+# COALESCE_DIR (a local directory) extends this across worker processes.
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'true').lower() == 'true'
+COALESCE_DIR = os.getenv('COALESCE_DIR')
+COALESCE_WAIT_SECONDS = float(os.getenv('COALESCE_WAIT_SECONDS', '30'))
+
+single_flight = (SingleFlight(FileResultStore(COALESCE_DIR) if COALESCE_DIR else None,
+                              wait_timeout=COALESCE_WAIT_SECONDS, private_errors=(CircuitOpen, DeadlineExceeded))
+                 if COALESCE_ENABLED else None)
+
+def call_llm(model_name, prompt, deadline=None):
+    """``llm_backend.generate`` behind the model's circuit breaker.
+
+    Each attempt is limited to ``LLM_CALL_TIMEOUT`` seconds and transient
+    failures (``is_retryable_error``) are retried with jittered exponential
+    backoff, but never past ``deadline`` (a ``time.monotonic()`` value, by
+    default ``ASK_DEADLINE_SECONDS`` away). Request-specific errors, such as
+    a blocked answer, are raised at once and not counted by the breaker.
+    Raises ``CircuitOpen`` without calling upstream while the breaker is open,
+    and ``DeadlineExceeded`` (not counted against the model) when an attempt
+    timed out only because the deadline shortened it.
+    """
+    breaker = circuit_breakers.get(model_name)
+    deadline = time.monotonic() + ASK_DEADLINE_SECONDS if deadline is None else deadline
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline reached before the model answered")
+        breaker.before_call()
+        timeout = min(LLM_CALL_TIMEOUT, remaining)
+        started = time.monotonic()
+        try:
+            answer = llm_backend.generate(model_name, prompt, timeout=timeout)
+        except TimeoutError as e:
+            if timeout < LLM_CALL_TIMEOUT:
+                breaker.release_trial()
+                raise DeadlineExceeded(f"Request deadline reached after {timeout:.1f}s waiting for {model_name}") from e
+            breaker.record_failure(time.monotonic() - started, e)
+            error = e
+        except Exception as e:
+            if not is_retryable_error(e):
+                breaker.release_trial()
+                raise
+            breaker.record_failure(time.monotonic() - started, e)
+            error = e
+        else:
+            breaker.record_success(time.monotonic() - started)
+            return answer
+        attempt += 1
+        delay = backoff_delay(attempt, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY)
+        if attempt > LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            raise error
+        LLM_RETRIES.labels(model_name).inc()
+        time.sleep(delay)
+
+def stream_llm(model_name, prompt, deadline=None):
+    """``llm_backend.stream`` behind the model's circuit breaker (no retries once text is sent).
 
-def generate_rag_response(query, retrieved_info):
-    """Generate response using Gemini with retrieved context"""
+    The whole stream gets ``LLM_CALL_TIMEOUT`` seconds, or less if
+    ``deadline`` is nearer. A stalled stream is abandoned so it does not
+    hold a generation worker, and counts as a failure unless it was the
+    deadline that cut it short (``DeadlineExceeded``, as in ``call_llm``).
+    Request-specific errors are not counted either.
+    """
+    breaker = circuit_breakers.get(model_name)
+    deadline = time.monotonic() + ASK_DEADLINE_SECONDS if deadline is None else deadline
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline reached before the model answered")
+    breaker.before_call()
+    timeout = min(LLM_CALL_TIMEOUT, remaining)
+    started = time.monotonic()
     try:
-        if not GEMINI_API_KEY:
-            return generate_fallback_response(query, retrieved_info)
-            
-        genai.configure(api_key=GEMINI_API_KEY)
-        model_name = get_available_model()
-        
-        if not model_name:
-            return generate_fallback_response(query, retrieved_info)
-            
-        model = genai.GenerativeModel(model_name)
-        
-        context = format_context_for_prompt(retrieved_info)
-        
-        prompt = f"""
+        yield from llm_backend.stream(model_name, prompt, timeout=timeout)
+    except TimeoutError as e:
+        if timeout < LLM_CALL_TIMEOUT:
+            breaker.release_trial()
+            raise DeadlineExceeded(f"Request deadline reached after {timeout:.1f}s streaming from {model_name}") from e
+        breaker.record_failure(time.monotonic() - started, e)
+        raise
+    except Exception as e:
+        if is_retryable_error(e):
+            breaker.record_failure(time.monotonic() - started, e)
+        else:
+            breaker.release_trial()
+        raise
+    breaker.record_success(time.monotonic() - started)
+
+def coalesced_generate(key, model_name, prompt, deadline=None):
+    """``call_llm`` shared by concurrent callers with the same key; returns ``(answer, shared)``.
+
+    Only the caller that produced the answer (``shared`` False) should
+    cache it. A caller never waits past its own deadline, and does not
+    inherit the leader's ``DeadlineExceeded`` or ``CircuitOpen`` (it calls
+    for itself).
+    """
+    deadline = time.monotonic() + ASK_DEADLINE_SECONDS if deadline is None else deadline
+    if single_flight is None:
+        return call_llm(model_name, prompt, deadline), False
+    return single_flight.do(key, call_llm, model_name, prompt, deadline, timeout=deadline - time.monotonic())
+
+# Static prompt text is built once; per call only the context and question are joined in
+RAG_PROMPT_PREFIX = """
 You are a helpful assistant for TechCorp Inc. Use ONLY the retrieved company information below to answer the question. 
 If the information isn't in the retrieved documents, say "This information is not available in our company knowledge base."
 
-{context}
+"""
+RAG_PROMPT_QUESTION = """
 
-QUESTION: {query}
+QUESTION: """
+RAG_PROMPT_SUFFIX = """
 
 IMPORTANT INSTRUCTIONS:
 1. Answer based ONLY on the retrieved company documents above
@@ -315,47 +521,129 @@ IMPORTANT INSTRUCTIONS:
 
 ANSWER:
 """
+
+DIRECT_PROMPT_PREFIX = """
+Answer the following question about a company using only your general knowledge.
+Do not pretend to have specific information about company policies or details.
+
+QUESTION: """
+DIRECT_PROMPT_SUFFIX = """
+
+If you don't have specific information, be honest about what you don't know.
+Provide a general answer based on common practices, but make it clear this is not company-specific. or just say that i dont have the information you need.
+
+ANSWER:
+"""
+
+def build_rag_prompt(query, retrieved_info):
+    """Build the grounded prompt for the RAG answer"""
+    context = format_context_for_prompt(retrieved_info)
+    return "".join((RAG_PROMPT_PREFIX, context, RAG_PROMPT_QUESTION, query, RAG_PROMPT_SUFFIX))
+
+def build_direct_prompt(query):
+    """Build the general-knowledge prompt for the comparison answer"""
+    return "".join((DIRECT_PROMPT_PREFIX, query, DIRECT_PROMPT_SUFFIX))
+
+def lookup_cached_rag_response(query, retrieved_info, model_name):
+    """Return ``(cache_key, cached_answer_or_None)`` from the exact and semantic caches"""
+    cache_key = make_cache_key(query, retrieved_info, model_name)
+    cached = response_cache.get(cache_key)
+    cache_status = 'exact' if cached is not None else 'miss'
+    if cached is None and semantic_cache is not None:
+        cached = semantic_cache.lookup(query, retrieved_info, model_name)
+        if cached is not None:
+            cache_status = 'semantic'
+    annotate(cache=cache_status)
+    return cache_key, cached
+
+def store_rag_response(cache_key, query, retrieved_info, model_name, answer):
+    """Remember a generated RAG answer in both caches"""
+    response_cache.set(cache_key, answer)
+    if semantic_cache is not None:
+        semantic_cache.add(query, retrieved_info, model_name, answer)
+
+@instrumented('rag_generation')
+def generate_rag_response(query, retrieved_info, deadline=None, raise_errors=False):
+    """Generate response using Gemini with retrieved context.
+
+    Failures become an error message (or the fallback answer while the
+    breaker is open or after the deadline) unless ``raise_errors`` is set,
+    as the batch API does.
+    """
+    model_name = None
+    try:
+        if not llm_backend.configured:
+            return generate_fallback_response(query, retrieved_info)
+            
+        model_name = get_available_model()
+        
+        if not model_name:
+            return generate_fallback_response(query, retrieved_info)
+        
+        cache_key, cached = lookup_cached_rag_response(query, retrieved_info, model_name)
+        if cached is not None:
+            return cached
         
-        response = model.generate_content(prompt)
-        return response.text
+        prompt = build_rag_prompt(query, retrieved_info)
+        PROMPT_SIZE.labels('rag').observe(len(prompt))
         
+        answer, shared = coalesced_generate(cache_key, model_name, prompt, deadline)
+        if not shared:
+            store_rag_response(cache_key, query, retrieved_info, model_name, answer)
+        return answer
+        
+    except (CircuitOpen, DeadlineExceeded):
+        if raise_errors:
+            raise
+        return generate_fallback_response(query, retrieved_info)
     except Exception as e:
+        report_model_error(model_name, e)
+        if raise_errors:
+            raise
+        STAGE_ERRORS.labels('rag_generation').inc()
         return f"Error generating RAG response: {str(e)}"
 
-def generate_direct_response(query):
-    """Generate response without RAG for comparison"""
+@instrumented('direct_generation')
+def generate_direct_response(query, deadline=None, raise_errors=False):
+    """Generate response without RAG for comparison (see ``generate_rag_response``)"""
+    model_name = None
     try:
-        if not GEMINI_API_KEY:
+        if not llm_backend.configured:
             return "Cannot generate direct response: API key not configured"
             
-        genai.configure(api_key=GEMINI_API_KEY)
         model_name = get_available_model()
         
         if not model_name:
             return "Cannot generate direct response: No available model"
-            
-        model = genai.GenerativeModel(model_name)
         
-        prompt = f"""
-Answer the following question about a company using only your general knowledge.
-Do not pretend to have specific information about company policies or details.
-
-QUESTION: {query}
-
-If you don't have specific information, be honest about what you don't know.
-Provide a general answer based on common practices, but make it clear this is not company-specific. or just say that i dont have the information you need.
-
-ANSWER:
-"""
+        cache_key = make_cache_key(query, None, model_name, kind='direct')
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        response = model.generate_content(prompt)
-        return response.text
+        prompt = build_direct_prompt(query)
+        PROMPT_SIZE.labels('direct').observe(len(prompt))
         
+        answer, shared = coalesced_generate(cache_key, model_name, prompt, deadline)
+        if not shared:
+            response_cache.set(cache_key, answer)
+        return answer
+        
+    except (CircuitOpen, DeadlineExceeded) as e:
+        if raise_errors:
+            raise
+        return f"Direct response unavailable: {e}"
     except Exception as e:
+        report_model_error(model_name, e)
+        if raise_errors:
+            raise
+        STAGE_ERRORS.labels('direct_generation').inc()
         return f"Error generating direct response: {str(e)}"
 
 def generate_fallback_response(query, retrieved_info):
     """Generate a fallback response when API fails"""
+    FALLBACKS.inc()
+    annotate(fallback=True)
     if retrieved_info:
         response_parts = ["Based on our company knowledge base:\n\n"]
         for info in retrieved_info:
@@ -364,9 +652,410 @@ def generate_fallback_response(query, retrieved_info):
     else:
         return "I don't have specific information about this in our company knowledge base. Please check with HR or relevant department."
 
+# Direct (no RAG) comparison answer: 'always' generates it with every question,
+# 'on-demand' only when the user opens it on the result page, 'off' never
+COMPARISON_MODE = os.getenv('COMPARISON_MODE', 'always').strip().lower()
+if COMPARISON_MODE not in ('always', 'on-demand', 'off'):
+    raise ValueError(f"Unknown comparison mode: {COMPARISON_MODE}")
+
+# Shared pool for running the RAG and direct generations side by side
+ASK_DEADLINE_SECONDS = float(os.getenv('ASK_DEADLINE_SECONDS', '30'))
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '16'))
+generation_pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix='generation')
+
+def generate_responses_concurrently(query, retrieved_info, deadline=None, include_direct=True):
+    """Run the RAG and direct generations in parallel under one deadline.
+
+    Returns ``(rag_response, direct_response, timed_out)`` where ``timed_out``
+    lists the sides that missed the deadline. A late RAG side falls back to
+    the retrieved documents; a late direct side gets a timed-out marker.
+    Without ``include_direct`` only the RAG answer is generated and
+    ``direct_response`` is None.
+    """
+    deadline = ASK_DEADLINE_SECONDS if deadline is None else deadline
+    started = time.monotonic()
+    rag_future = submit_with_context(generation_pool, generate_rag_response, query, retrieved_info, started + deadline)
+    if not include_direct:
+        wait([rag_future], timeout=deadline)
+        if rag_future.done():
+            return rag_future.result(), None, []
+        rag_future.cancel()
+        return generate_fallback_response(query, retrieved_info), None, ['rag']
+    direct_future = submit_with_context(generation_pool, generate_direct_response, query, started + deadline)
+
+    wait([rag_future, direct_future], timeout=deadline)
+    elapsed = time.monotonic() - started
+    timed_out = []
+
+    if rag_future.done():
+        rag_response = rag_future.result()
+    else:
+        rag_future.cancel()
+        timed_out.append('rag')
+        rag_response = generate_fallback_response(query, retrieved_info)
+
+    if direct_future.done():
+        direct_response = direct_future.result()
+    else:
+        direct_future.cancel()
+        timed_out.append('direct')
+        direct_response = f"Direct response timed out after {elapsed:.1f}s"
+
+    return rag_response, direct_response, timed_out
+
+def stream_rag_response(query, retrieved_info, deadline=None):
+    """Yield the RAG answer piece by piece as Gemini streams it"""
+    model_name = None
+    try:
+        if not llm_backend.configured:
+            yield generate_fallback_response(query, retrieved_info)
+            return
+            
+        model_name = get_available_model()
+        if not model_name:
+            yield generate_fallback_response(query, retrieved_info)
+            return
+        
+        cache_key, cached = lookup_cached_rag_response(query, retrieved_info, model_name)
+        if cached is not None:
+            yield cached
+            return
+            
+        parts = []
+        for text in stream_llm(model_name, build_rag_prompt(query, retrieved_info), deadline):
+            parts.append(text)
+            yield text
+        store_rag_response(cache_key, query, retrieved_info, model_name, "".join(parts))
+        
+    except (CircuitOpen, DeadlineExceeded):
+        yield generate_fallback_response(query, retrieved_info)
+    except Exception as e:
+        report_model_error(model_name, e)
+        STAGE_ERRORS.labels('rag_generation').inc()
+        yield f"Error generating RAG response: {str(e)}"
+
+def stream_direct_response(query, deadline=None):
+    """Yield the direct (no RAG) answer piece by piece as Gemini streams it"""
+    model_name = None
+    try:
+        if not llm_backend.configured:
+            yield "Cannot generate direct response: API key not configured"
+            return
+            
+        model_name = get_available_model()
+        if not model_name:
+            yield "Cannot generate direct response: No available model"
+            return
+        
+        cache_key = make_cache_key(query, None, model_name, kind='direct')
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+            
+        parts = []
+        for text in stream_llm(model_name, build_direct_prompt(query), deadline):
+            parts.append(text)
+            yield text
+        response_cache.set(cache_key, "".join(parts))
+        
+    except (CircuitOpen, DeadlineExceeded) as e:
+        yield f"Direct response unavailable: {e}"
+    except Exception as e:
+        report_model_error(model_name, e)
+        STAGE_ERRORS.labels('direct_generation').inc()
+        yield f"Error generating direct response: {str(e)}"
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_answer_events(query, retrieved_info, api_valid, api_message, deadline=None, include_direct=True):
+    """Yield SSE events: sources first, then interleaved RAG/direct tokens"""
+    yield sse_event('sources', {
+        'query': query,
+        'retrieved_info': retrieved_info,
+        'rag_advantage': len(retrieved_info) > 0,
+        'comparison_mode': COMPARISON_MODE if not include_direct else 'always'
+    })
+
+    if not api_valid:
+        yield sse_event('token', {'side': 'rag', 'text': generate_fallback_response(query, retrieved_info)})
+        yield sse_event('done', {'side': 'rag'})
+        if include_direct:
+            yield sse_event('token', {'side': 'direct', 'text': "Cannot generate direct response: " + api_message})
+            yield sse_event('done', {'side': 'direct'})
+        yield sse_event('end', {'api_error': api_message})
+        return
+
+    events = queue.Queue()
+
+    def pump(side, pieces):
+        try:
+            for text in pieces:
+                events.put((side, text))
+        finally:
+            events.put((side, None))
+
+    # The streams stop at the same deadline, so a stalled upstream frees its worker
+    expires = time.monotonic() + (ASK_DEADLINE_SECONDS if deadline is None else deadline)
+    submit_with_context(generation_pool, pump, 'rag', stream_rag_response(query, retrieved_info, expires))
+    pending = {'rag'}
+    if include_direct:
+        submit_with_context(generation_pool, pump, 'direct', stream_direct_response(query, expires))
+        pending.add('direct')
+
+    while pending:
+        try:
+            side, text = events.get(timeout=max(expires - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if text is None:
+            pending.discard(side)
+            yield sse_event('done', {'side': side})
+        else:
+            yield sse_event('token', {'side': side, 'text': text})
+
+    # Whatever is still running missed the deadline
+    if 'rag' in pending:
+        yield sse_event('timeout', {'side': 'rag', 'text': generate_fallback_response(query, retrieved_info)})
+    if 'direct' in pending:
+        yield sse_event('timeout', {'side': 'direct', 'text': "Direct response timed out"})
+    yield sse_event('end', {'timed_out': sorted(pending)})
+
+# Batch API: unique queries fan out over a bounded pool with per-item timeouts
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', '100'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+BATCH_ITEM_TIMEOUT_SECONDS = float(os.getenv('BATCH_ITEM_TIMEOUT_SECONDS', '30'))
+BATCH_DEADLINE_SECONDS = float(os.getenv('BATCH_DEADLINE_SECONDS', '120'))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+
+def run_batch(queries, include_direct=True, item_timeout=None, deadline=None):
+    """Answer a list of queries: dedup, retrieve in one pass, then fan out generations.
+
+    Each generation is timed from when a worker picks it up, so queued items
+    are not penalised for waiting behind others. Items that run past
+    ``item_timeout`` (or are still pending when the batch ``deadline`` hits)
+    are reported as timed out, and items whose generation failed as errors
+    (an error is never downgraded to a timeout); the RAG side then gets the
+    fallback answer.
+    """
+    item_timeout = BATCH_ITEM_TIMEOUT_SECONDS if item_timeout is None else item_timeout
+    deadline = BATCH_DEADLINE_SECONDS if deadline is None else deadline
+    batch_started = time.monotonic()
+
+    # Dedup on the normalized query; the first occurrence is the canonical one
+    unique = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query), query)
+
+    # Retrieval for every unique query against one knowledge snapshot
+    snapshot = knowledge_store.current
+    items = {}
+    for key, query in unique.items():
+        started = time.monotonic()
+        retrieved_info = retrieve_relevant_info(query, snapshot=snapshot)
+        items[key] = {
+            'query': query,
+            'retrieved_info': retrieved_info,
+            'timings_ms': {'retrieval': round((time.monotonic() - started) * 1000, 2)},
+            'status': 'ok',
+        }
+
+    started_at = {}
+
+    def work(key, side):
+        began = started_at[(key, side)] = time.monotonic()
+        item_deadline = min(began + item_timeout, batch_started + deadline)
+        item = items[key]
+        if side == 'rag':
+            return generate_rag_response(item['query'], item['retrieved_info'], item_deadline, raise_errors=True)
+        return generate_direct_response(item['query'], item_deadline, raise_errors=True)
+
+    sides = ('rag', 'direct') if include_direct else ('rag',)
+    futures = {submit_with_context(batch_pool, work, key, side): (key, side) for key in items for side in sides}
+
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        batch_left = batch_started + deadline - now
+        expired = set()
+        next_expiry = batch_left
+        for future in pending:
+            began = started_at.get(futures[future])
+            if batch_left <= 0 or (began is not None and now - began >= item_timeout):
+                expired.add(future)
+            elif began is not None:
+                next_expiry = min(next_expiry, began + item_timeout - now)
+        for future in expired:
+            future.cancel()
+            key, side = futures[future]
+            began = started_at.get((key, side))
+            items[key]['timings_ms'][side] = round((now - began) * 1000, 2) if began is not None else None
+            if items[key]['status'] == 'ok':
+                items[key]['status'] = 'timeout'
+            items[key][f'{side}_response'] = (generate_fallback_response(items[key]['query'], items[key]['retrieved_info'])
+                                             if side == 'rag' else "Direct response timed out")
+        pending -= expired
+        if not pending:
+            break
+        done, pending = wait(pending, timeout=max(min(next_expiry, 0.5), 0.01), return_when=FIRST_COMPLETED)
+        for future in done:
+            key, side = futures[future]
+            item = items[key]
+            began = started_at.get((key, side), batch_started)
+            item['timings_ms'][side] = round((time.monotonic() - began) * 1000, 2)
+            try:
+                item[f'{side}_response'] = future.result()
+            except DeadlineExceeded:
+                if item['status'] == 'ok':
+                    item['status'] = 'timeout'
+                item[f'{side}_response'] = (generate_fallback_response(item['query'], item['retrieved_info'])
+                                           if side == 'rag' else "Direct response timed out")
+            except Exception as e:
+                item['status'] = 'error'
+                item.setdefault('error', f"{side}: {e}")
+                item[f'{side}_response'] = (generate_fallback_response(item['query'], item['retrieved_info'])
+                                           if side == 'rag' else None)
+
+    results = []
+    seen = set()
+    for query in queries:
+        key = normalize_query(query)
+        item = items[key]
+        results.append({
+            'query': query,
+            'deduplicated': key in seen,
+            'status': item['status'],
+            'rag_response': item.get('rag_response'),
+            'direct_response': item.get('direct_response'),
+            'sources': [{'id': info['id'], 'title': info['title'], 'source': info['source'], 'score': info['score']}
+                        for info in item['retrieved_info']],
+            'timings_ms': item['timings_ms'],
+            **({'error': item['error']} if 'error' in item else {}),
+        })
+        seen.add(key)
+
+    return {
+        'results': results,
+        'unique_queries': len(items),
+        'total_ms': round((time.monotonic() - batch_started) * 1000, 2),
+    }
+
+# Per-request timing: stage durations feed the optional Server-Timing header
+TIMING_HEADER_ENABLED = os.getenv('TIMING_HEADER_ENABLED', 'false').lower() == 'true'
+
+# Query log: one JSON line per question (query, documents, model, stage timings,
+# cache and fallback status), buffered in memory and written by a background thread
+QUERY_LOG_ENABLED = os.getenv('QUERY_LOG_ENABLED', 'true').lower() == 'true'
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'requests.jsonl'))
+QUERY_LOG_FLUSH_SECONDS = float(os.getenv('QUERY_LOG_FLUSH_SECONDS', '1'))
+QUERY_LOG_MAX_BYTES = int(os.getenv('QUERY_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+QUERY_LOG_BACKUPS = int(os.getenv('QUERY_LOG_BACKUPS', '5'))
+QUERY_LOG_ENDPOINTS = {'ask_question', 'ask_stream', 'ask_direct', 'ask_batch'}
+
+query_logger = None
+if QUERY_LOG_ENABLED:
+    query_logger = QueryLogger(QUERY_LOG_PATH, flush_interval=QUERY_LOG_FLUSH_SECONDS,
+                               max_bytes=QUERY_LOG_MAX_BYTES, backup_count=QUERY_LOG_BACKUPS).start()
+    atexit.register(query_logger.close)
+
+def log_query(endpoint, method, query, status, started_at, started, timings, fields):
+    """Queue one query log entry; serialization and file I/O happen on the logger thread"""
+    if query_logger is None:
+        return
+    entry = {
+        'ts': round(started_at, 3),
+        'endpoint': endpoint,
+        'method': method,
+        'status': status,
+        'total_ms': round((time.perf_counter() - started) * 1000, 2),
+        'timings_ms': {stage: round(seconds * 1000, 2) for stage, seconds in dict(timings or {}).items()},
+    }
+    if isinstance(query, list):
+        # Batch: per-query documents and cache status are in the response, not the log
+        entry['queries'] = query
+        entry['fallback'] = bool(fields.get('fallback'))
+    else:
+        entry['query'] = query
+        entry.update({'documents': None, 'model': None, 'cache': None, 'fallback': False})
+        entry.update(dict(fields))
+    query_logger.record(entry)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_started_at = time.time()
+    g.timing_token = start_request_timing()
+    g.log_token, g.log_fields = start_request_fields()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    token = g.pop('timing_token', None)
+    timings = None
+    if started is not None:
+        REQUEST_LATENCY.labels(request.endpoint or 'unknown').observe(time.perf_counter() - started)
+    if token is not None:
+        timings = stop_request_timing(token)
+        if TIMING_HEADER_ENABLED and timings:
+            response.headers['Server-Timing'] = server_timing_header(timings)
+    log_token = g.pop('log_token', None)
+    if log_token is not None:
+        stop_request_fields(log_token)
+        if query_logger is not None and started is not None and request.endpoint in QUERY_LOG_ENDPOINTS:
+            if request.endpoint == 'ask_batch':
+                payload = request.get_json(silent=True)
+                query = payload.get('queries') if isinstance(payload, dict) else None
+                query = query if isinstance(query, list) else None
+            else:
+                query = request.values.get('query', '').strip()
+            if query:
+                entry_args = (request.endpoint, request.method, query, response.status_code,
+                              g.request_started_at, started, timings, g.log_fields)
+                # Logged when the response is closed, so streamed answers are fully timed
+                response.call_on_close(lambda: log_query(*entry_args))
+    return response
+
+def _registry_gauges():
+    stats = model_registry.stats()
+    return {
+        (('counter', 'probe_calls'),): stats['probe_calls'],
+        (('counter', 'probes_avoided'),): stats['probes_avoided'],
+    }
+
+def _cache_gauges():
+    samples = {}
+    for name, cache in (('exact', response_cache), ('semantic', semantic_cache)):
+        if cache is None:
+            continue
+        stats = cache.stats()
+        for field in ('hits', 'misses', 'evictions', 'entries'):
+            if field in stats:
+                samples[(('cache', name), ('field', field))] = stats[field]
+    return samples
+
+REGISTRY.gauge_callback('rag_model_registry', 'Model registry probe counters', _registry_gauges)
+def _coalescing_gauges():
+    if single_flight is None:
+        return {}
+    stats = single_flight.stats()
+    return {(('field', field),): stats[field]
+            for field in ('in_flight', 'leaders', 'coalesced', 'coalesced_cross_worker', 'wait_timeouts')}
+
+REGISTRY.gauge_callback('rag_cache', 'Answer cache counters', _cache_gauges)
+REGISTRY.gauge_callback('rag_coalescing', 'Single-flight generation coalescing counters', _coalescing_gauges)
+REGISTRY.gauge_callback('rag_circuit_open', 'Whether the circuit breaker for a model is open (1) or half-open (0.5)',
+                        lambda: {(('model', name),): {'open': 1, 'half_open': 0.5}.get(stats['state'], 0)
+                                 for name, stats in circuit_breakers.stats().items()})
+
+@app.context_processor
+def inject_comparison_mode():
+    return {'comparison_mode': COMPARISON_MODE}
+
 @app.route('/')
 def index():
-    # Test API key on homepage load
+    # Cached API/model health, no probe on page load
     api_valid, api_message = test_api_key()
     return render_template('index.html', api_valid=api_valid, api_message=api_message)
 
@@ -378,13 +1067,14 @@ def ask_question():
         if not query:
             return jsonify({'error': 'Please enter a question'})
         
-        # Test API key first
+        # Check cached API/model health first
         api_valid, api_message = test_api_key()
         if not api_valid:
             # Use fallback responses if API is invalid
             retrieved_info = retrieve_relevant_info(query)
             rag_response = generate_fallback_response(query, retrieved_info)
-            direct_response = "Cannot generate direct response: " + api_message
+            direct_response = ("Cannot generate direct response: " + api_message
+                               if COMPARISON_MODE == 'always' else None)
             
             return render_template('result.html', 
                                  query=query,
@@ -397,11 +1087,23 @@ def ask_question():
         # Step 1: Retrieve relevant information
         retrieved_info = retrieve_relevant_info(query)
         
-        # Step 2: Generate RAG response
-        rag_response = generate_rag_response(query, retrieved_info)
+        # Gemini is failing: answer from the cache or the documents right away
+        model_name = get_available_model(replaces_probe=False)
+        if model_name and circuit_breakers.get(model_name).is_open():
+            _, cached = lookup_cached_rag_response(query, retrieved_info, model_name)
+            return render_template('result.html',
+                                 query=query,
+                                 retrieved_info=retrieved_info,
+                                 rag_response=cached if cached is not None else generate_fallback_response(query, retrieved_info),
+                                 direct_response=(f"Direct response unavailable: {model_name} is temporarily failing"
+                                                  if COMPARISON_MODE == 'always' else None),
+                                 rag_advantage=len(retrieved_info) > 0,
+                                 circuit_open=cached is None)
         
-        # Step 3: Generate direct response for comparison
-        direct_response = generate_direct_response(query)
+        # Step 2 & 3: Generate the RAG answer, plus the direct comparison concurrently
+        # unless it is fetched on demand (or disabled)
+        rag_response, direct_response, timed_out = generate_responses_concurrently(
+            query, retrieved_info, include_direct=COMPARISON_MODE == 'always')
         
         # Determine which response is better
         rag_advantage = len(retrieved_info) > 0
@@ -411,18 +1113,97 @@ def ask_question():
                              retrieved_info=retrieved_info,
                              rag_response=rag_response,
                              direct_response=direct_response,
-                             rag_advantage=rag_advantage)
+                             rag_advantage=rag_advantage,
+                             timed_out=timed_out)
                              
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}'})
 
+@app.route('/ask/stream')
+def ask_stream():
+    """Stream sources, then RAG and direct answer tokens, as Server-Sent Events"""
+    query = request.args.get('query', '').strip()
+    if not query:
+        return jsonify({'error': 'Please enter a question'}), 400
+    
+    retrieved_info = retrieve_relevant_info(query)
+    api_valid, api_message = test_api_key()
+    return Response(iterate_with_context(stream_answer_events(query, retrieved_info, api_valid, api_message,
+                                                              include_direct=COMPARISON_MODE == 'always')),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/ask/direct')
+def ask_direct():
+    """Direct (no RAG) answer for the comparison panel, fetched lazily in on-demand mode"""
+    if COMPARISON_MODE == 'off':
+        return jsonify({'error': 'Direct answers are disabled'}), 404
+    query = request.args.get('query', '').strip()
+    if not query:
+        return jsonify({'error': 'Please enter a question'}), 400
+    
+    response = jsonify({'query': query, 'direct_response': generate_direct_response(query)})
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+@app.route('/api/ask/batch', methods=['POST'])
+def ask_batch():
+    """JSON batch API: {"queries": [...], "include_direct": true, "timeout": 30}
+
+    ``include_direct`` defaults to true only in the 'always' comparison mode.
+    ``timeout`` (seconds per item) is capped at ``BATCH_DEADLINE_SECONDS``.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object body'}), 400
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': '"queries" must be a list of strings'}), 400
+    queries = [q.strip() for q in queries if q.strip()]
+    if not queries:
+        return jsonify({'error': 'Please provide at least one question'}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 400
+    
+    item_timeout = payload.get('timeout')
+    if item_timeout is not None:
+        if (isinstance(item_timeout, bool) or not isinstance(item_timeout, (int, float))
+                or not math.isfinite(item_timeout) or item_timeout <= 0):
+            return jsonify({'error': '"timeout" must be a positive number of seconds'}), 400
+        item_timeout = min(float(item_timeout), BATCH_DEADLINE_SECONDS)
+    
+    include_direct = payload.get('include_direct', COMPARISON_MODE == 'always')
+    if not isinstance(include_direct, bool):
+        return jsonify({'error': '"include_direct" must be true or false'}), 400
+    
+    return jsonify(run_batch(queries,
+                             include_direct=COMPARISON_MODE != 'off' and include_direct,
+                             item_timeout=item_timeout))
+
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus text exposition of latency histograms and counters"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test-api')
 def test_api_route():
     """Route to test API key"""
     api_valid, api_message = test_api_key()
     return jsonify({
         'valid': api_valid,
-        'message': api_message
+        'message': api_message,
+        'registry': model_registry.stats(),
+        'circuit_breakers': circuit_breakers.stats()
+    })
+
+@app.route('/cache-stats')
+def cache_stats_route():
+    """Route to inspect the answer cache counters"""
+    return jsonify({
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None,
+        'coalescing': single_flight.stats() if single_flight is not None else None,
+        'query_log': query_logger.stats() if query_logger is not None else None
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,432 @@
+"""Async serving mode: ``uvicorn asgi:application``.
+
+``/ask`` is handled natively on the event loop, so a slow Gemini call holds
+a coroutine rather than a worker thread and one process can keep hundreds
+of generations in flight. Upstream calls go through an admission limit;
+when it is saturated requests queue briefly and then get a fast 503.
+Steps that can block (retrieval, the model registry before its first
+probe finishes, SQLite cache lookups) run in threads. Every other route is the unchanged
+Flask app, run on a small thread pool.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from flask import render_template
+
+import app as rag
+from admission import AdmissionController, Overloaded
+from circuit_breaker import CircuitOpen, DeadlineExceeded, backoff_delay
+from llm_backend import is_retryable_error
+from query_log import start_request_fields, stop_request_fields
+from response_cache import make_cache_key
+from single_flight import AsyncSingleFlight
+from metrics import (REGISTRY, LLM_RETRIES, PROMPT_SIZE, REQUEST_LATENCY, STAGE_ERRORS, record_stage, server_timing_header,
+                     start_request_timing, stop_request_timing)
+
+# Concurrent upstream LLM calls, and how many more may wait (and for how long) before a 503
+ASGI_MAX_INFLIGHT = int(os.getenv('ASGI_MAX_INFLIGHT', '256'))
+ASGI_MAX_QUEUE = int(os.getenv('ASGI_MAX_QUEUE', '512'))
+ASGI_QUEUE_TIMEOUT = float(os.getenv('ASGI_QUEUE_TIMEOUT', '2'))
+# Threads running the regular Flask routes
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '32'))
+
+
+async def off_loop(blocking, func, *args, **kwargs):
+    """Run ``func`` in a thread if it may block, else inline.
+
+    Inline calls keep the order in which concurrent requests reach the
+    admission queue, so only calls that can really wait are moved.
+    """
+    if blocking:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+async def call_llm_async(model_name, prompt, admission, deadline):
+    """Async counterpart of ``app.call_llm``: breaker, per-attempt timeout and bounded retries.
+
+    Only the upstream call itself holds an admission slot, not the backoff
+    sleeps. The breaker is consulted once admitted, so a rejected or
+    cancelled wait for a slot never holds a half-open trial.
+    """
+    breaker = rag.circuit_breakers.get(model_name)
+    attempt = 0
+    while True:
+        async with admission:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("Request deadline reached before the model answered")
+            breaker.before_call()
+            timeout = min(rag.LLM_CALL_TIMEOUT, remaining)
+            started = time.monotonic()
+            try:
+                answer = await rag.llm_backend.agenerate(model_name, prompt, timeout=timeout)
+            except asyncio.CancelledError:
+                breaker.release_trial()
+                raise
+            except TimeoutError as e:
+                if timeout < rag.LLM_CALL_TIMEOUT:
+                    breaker.release_trial()
+                    raise DeadlineExceeded(f"Request deadline reached after {timeout:.1f}s waiting for {model_name}") from e
+                breaker.record_failure(time.monotonic() - started, e)
+                error = e
+            except Exception as e:
+                if not is_retryable_error(e):
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure(time.monotonic() - started, e)
+                error = e
+            else:
+                breaker.record_success(time.monotonic() - started)
+                return answer
+        attempt += 1
+        delay = backoff_delay(attempt, rag.LLM_RETRY_BASE_DELAY, rag.LLM_RETRY_MAX_DELAY)
+        if attempt > rag.LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+            raise error
+        LLM_RETRIES.labels(model_name).inc()
+        await asyncio.sleep(delay)
+
+
+async def coalesced_agenerate(key, model_name, prompt, admission, deadline, coalescer=None):
+    """One upstream call, shared by concurrent callers with the same key; returns ``(answer, shared)``"""
+    if coalescer is None:
+        return await call_llm_async(model_name, prompt, admission, deadline), False
+    return await coalescer.do(key, call_llm_async, model_name, prompt, admission, deadline,
+                              timeout=deadline - time.monotonic())
+
+
+async def generate_rag_response_async(query, retrieved_info, admission, deadline, coalescer=None):
+    """Async counterpart of ``app.generate_rag_response``; raises ``Overloaded`` if not admitted"""
+    started = time.perf_counter()
+    model_name = None
+    try:
+        if not rag.llm_backend.configured:
+            return rag.generate_fallback_response(query, retrieved_info)
+
+        model_name = await off_loop(not rag.model_registry.ready, rag.get_available_model)
+        if not model_name:
+            return rag.generate_fallback_response(query, retrieved_info)
+
+        cache_key, cached = await off_loop(rag.response_cache.blocking, rag.lookup_cached_rag_response,
+                                           query, retrieved_info, model_name)
+        if cached is not None:
+            return cached
+
+        prompt = rag.build_rag_prompt(query, retrieved_info)
+        PROMPT_SIZE.labels('rag').observe(len(prompt))
+
+        answer, shared = await coalesced_agenerate(cache_key, model_name, prompt, admission, deadline, coalescer)
+        if not shared:
+            await off_loop(rag.response_cache.blocking, rag.store_rag_response,
+                           cache_key, query, retrieved_info, model_name, answer)
+        return answer
+
+    except Overloaded:
+        raise
+    except (CircuitOpen, DeadlineExceeded):
+        return rag.generate_fallback_response(query, retrieved_info)
+    except Exception as e:
+        rag.report_model_error(model_name, e)
+        STAGE_ERRORS.labels('rag_generation').inc()
+        return f"Error generating RAG response: {str(e)}"
+    finally:
+        record_stage('rag_generation', time.perf_counter() - started)
+
+
+async def generate_direct_response_async(query, admission, deadline, coalescer=None):
+    """Async counterpart of ``app.generate_direct_response``; raises ``Overloaded`` if not admitted"""
+    started = time.perf_counter()
+    model_name = None
+    try:
+        if not rag.llm_backend.configured:
+            return "Cannot generate direct response: API key not configured"
+
+        model_name = await off_loop(not rag.model_registry.ready, rag.get_available_model)
+        if not model_name:
+            return "Cannot generate direct response: No available model"
+
+        cache_key = make_cache_key(query, None, model_name, kind='direct')
+        cached = await off_loop(rag.response_cache.blocking, rag.response_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = rag.build_direct_prompt(query)
+        PROMPT_SIZE.labels('direct').observe(len(prompt))
+
+        answer, shared = await coalesced_agenerate(cache_key, model_name, prompt, admission, deadline, coalescer)
+        if not shared:
+            await off_loop(rag.response_cache.blocking, rag.response_cache.set, cache_key, answer)
+        return answer
+
+    except Overloaded:
+        raise
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return f"Direct response unavailable: {e}"
+    except Exception as e:
+        rag.report_model_error(model_name, e)
+        STAGE_ERRORS.labels('direct_generation').inc()
+        return f"Error generating direct response: {str(e)}"
+    finally:
+        record_stage('direct_generation', time.perf_counter() - started)
+
+
+def wsgi_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')),
+                    (b'content-length', str(len(body)).encode('latin-1'))] +
+                   [(k.encode('latin-1'), str(v).encode('latin-1')) for k, v in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AsgiApp:
+    """ASGI wrapper around the Flask app with a native async ``POST /ask``.
+
+    The lazily fetched ``GET /ask/direct`` of the on-demand comparison mode
+    goes through the Flask app like every other route.
+    """
+
+    def __init__(self, flask_app, admission, coalescer=None, wsgi_threads=ASGI_WSGI_THREADS):
+        self.flask_app = flask_app
+        self.admission = admission
+        self.coalescer = coalescer
+        self.executor = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = await read_body(receive)
+        if scope['method'] == 'POST' and scope['path'] == '/ask':
+            await self.ask(scope, body, send)
+        else:
+            await self.call_wsgi(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, body, send):
+        """Run a Flask route in the thread pool, streaming its body chunk by chunk"""
+        loop = asyncio.get_running_loop()
+        environ = wsgi_environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = await loop.run_in_executor(self.executor, self.flask_app.wsgi_app, environ, start_response)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response['headers']],
+            })
+            chunks = iter(result)
+            done = object()
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, done)
+                if chunk is done:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    async def ask(self, scope, body, send):
+        started, started_at = time.perf_counter(), time.time()
+        token = start_request_timing()
+        log_token, log_fields = start_request_fields()
+        try:
+            status, payload, content_type, headers = await self.answer(scope, body)
+        finally:
+            timings = stop_request_timing(token)
+            stop_request_fields(log_token)
+            REQUEST_LATENCY.labels('ask_question').observe(time.perf_counter() - started)
+        if rag.TIMING_HEADER_ENABLED and timings:
+            headers = list(headers) + [('server-timing', server_timing_header(timings))]
+        await send_response(send, status, payload, content_type, headers)
+        query = parse_qs(body.decode('utf-8', 'replace')).get('query', [''])[0].strip()
+        if query:
+            rag.log_query('ask_question', 'POST', query, status, started_at, started, timings, log_fields)
+
+    def render(self, scope, body, **context):
+        with self.flask_app.request_context(wsgi_environ(scope, body)):
+            return render_template('result.html', **context)
+
+    async def answer(self, scope, body):
+        """Return ``(status, body, content_type, headers)`` for ``POST /ask``"""
+        html = 'text/html; charset=utf-8'
+        try:
+            form = parse_qs(body.decode('utf-8'))
+            query = form.get('query', [''])[0].strip()
+
+            if not query:
+                return 200, json.dumps({'error': 'Please enter a question'}), 'application/json', ()
+
+            # Same cached health check and retrieval as the sync route, off the event loop
+            (api_valid, api_message), retrieved_info = await asyncio.gather(
+                asyncio.to_thread(rag.test_api_key), asyncio.to_thread(rag.retrieve_relevant_info, query))
+            if not api_valid:
+                return 200, self.render(scope, body,
+                                        query=query,
+                                        retrieved_info=retrieved_info,
+                                        rag_response=rag.generate_fallback_response(query, retrieved_info),
+                                        direct_response=("Cannot generate direct response: " + api_message
+                                                         if rag.COMPARISON_MODE == 'always' else None),
+                                        rag_advantage=len(retrieved_info) > 0,
+                                        api_error=api_message), html, ()
+
+            # Gemini is failing: answer from the cache or the documents right away
+            model_name = await off_loop(not rag.model_registry.ready, rag.get_available_model, replaces_probe=False)
+            if model_name and rag.circuit_breakers.get(model_name).is_open():
+                _, cached = await off_loop(rag.response_cache.blocking, rag.lookup_cached_rag_response,
+                                           query, retrieved_info, model_name)
+                return 200, self.render(scope, body,
+                                        query=query,
+                                        retrieved_info=retrieved_info,
+                                        rag_response=(cached if cached is not None
+                                                      else rag.generate_fallback_response(query, retrieved_info)),
+                                        direct_response=(f"Direct response unavailable: {model_name} is temporarily failing"
+                                                         if rag.COMPARISON_MODE == 'always' else None),
+                                        rag_advantage=len(retrieved_info) > 0,
+                                        circuit_open=cached is None), html, ()
+
+            generation_started = time.monotonic()
+            deadline = generation_started + rag.ASK_DEADLINE_SECONDS
+            rag_task = asyncio.ensure_future(generate_rag_response_async(query, retrieved_info, self.admission,
+                                                                              deadline, self.coalescer))
+            # The direct comparison is only generated here in 'always' mode
+            direct_task = None
+            if rag.COMPARISON_MODE == 'always':
+                direct_task = asyncio.ensure_future(generate_direct_response_async(query, self.admission, deadline,
+                                                                                    self.coalescer))
+            await asyncio.wait({task for task in (rag_task, direct_task) if task is not None},
+                               timeout=rag.ASK_DEADLINE_SECONDS)
+            elapsed = time.monotonic() - generation_started
+
+            if rag_task.done() and isinstance(rag_task.exception(), Overloaded):
+                if direct_task is not None and not direct_task.cancel():
+                    direct_task.exception()
+                error = rag_task.exception()
+                return (503, json.dumps({'error': 'Server is busy, please retry shortly'}), 'application/json',
+                        [('retry-after', error.retry_after)])
+
+            timed_out = []
+            if rag_task.done():
+                rag_response = rag_task.result()
+            else:
+                rag_task.cancel()
+                timed_out.append('rag')
+                rag_response = rag.generate_fallback_response(query, retrieved_info)
+
+            if direct_task is None:
+                direct_response = None
+            elif not direct_task.done():
+                direct_task.cancel()
+                timed_out.append('direct')
+                direct_response = f"Direct response timed out after {elapsed:.1f}s"
+            elif isinstance(direct_task.exception(), Overloaded):
+                direct_response = "Direct response skipped: server is at capacity"
+            else:
+                direct_response = direct_task.result()
+
+            return 200, self.render(scope, body,
+                                    query=query,
+                                    retrieved_info=retrieved_info,
+                                    rag_response=rag_response,
+                                    direct_response=direct_response,
+                                    rag_advantage=len(retrieved_info) > 0,
+                                    timed_out=timed_out), html, ()
+
+        except Exception as e:
+            return 200, json.dumps({'error': f'An error occurred: {str(e)}'}), 'application/json', ()
+
+
+def create_app(flask_app=None, admission=None, wsgi_threads=ASGI_WSGI_THREADS):
+    """Build the ASGI application around the Flask app and one shared admission limit"""
+    admission = admission or AdmissionController(ASGI_MAX_INFLIGHT, ASGI_MAX_QUEUE, ASGI_QUEUE_TIMEOUT)
+    coalescer = AsyncSingleFlight(private_errors=(CircuitOpen, DeadlineExceeded)) if rag.COALESCE_ENABLED else None
+    return AsgiApp(flask_app or rag.app, admission, coalescer, wsgi_threads)
+
+
+application = create_app()
+
+REGISTRY.gauge_callback('rag_admission', 'Async upstream admission control',
+                        lambda: {(('field', k),): v for k, v in application.admission.stats().items()})
+REGISTRY.gauge_callback('rag_async_coalescing', 'Async single-flight generation coalescing counters',
+                        lambda: {(('field', k),): v for k, v in application.coalescer.stats().items()}
+                        if application.coalescer is not None else {})
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The async server needs uvicorn: pip install uvicorn")
+    uvicorn.run(application, host='0.0.0.0', port=5000)
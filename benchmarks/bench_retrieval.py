@@ -0,0 +1,58 @@
+"""Micro-benchmarks for retrieve_relevant_info and format_context_for_prompt.
+
+    python -m benchmarks.bench_retrieval --sizes 20 1000 10000 100000 --output bench/retrieval.json
+"""
+import argparse
+import time
+
+from benchmarks.common import SAMPLE_QUERIES, configure_offline_app, summarize, synthetic_knowledge_base, write_results
+
+
+def run(sizes, iterations, mode):
+    import app
+
+    results = []
+    for size in sizes:
+        knowledge_base = synthetic_knowledge_base(app.COMPANY_KNOWLEDGE_BASE, size)
+        started = time.perf_counter()
+        app.knowledge_store = app.build_knowledge_store(knowledge_base)
+        build_seconds = time.perf_counter() - started
+
+        retrieve_times, format_times, documents = [], [], []
+        for n in range(iterations):
+            query = SAMPLE_QUERIES[n % len(SAMPLE_QUERIES)]
+            started = time.perf_counter()
+            retrieved_info = app.retrieve_relevant_info(query)
+            retrieve_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            app.format_context_for_prompt(retrieved_info)
+            format_times.append(time.perf_counter() - started)
+            documents.append(len(retrieved_info))
+
+        results.append({
+            'size': size,
+            'mode': mode,
+            'build_seconds': round(build_seconds, 3),
+            'avg_documents': round(sum(documents) / len(documents), 2),
+            'retrieve_relevant_info': summarize(retrieve_times),
+            'format_context_for_prompt': summarize(format_times),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 1000, 10000, 100000])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--mode', choices=['keyword', 'dense', 'hybrid'], default='keyword')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    # No on-disk dense index: each size is built in memory
+    configure_offline_app(RETRIEVAL_MODE=args.mode, DENSE_INDEX_DIR='', SEMANTIC_CACHE_ENABLED='false')
+    write_results('retrieval', run(args.sizes, args.iterations, args.mode), args.output)
+
+
+if __name__ == '__main__':
+    main()
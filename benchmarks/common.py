@@ -0,0 +1,98 @@
+import json
+import os
+import platform
+import random
+import sys
+from datetime import datetime
+
+SAMPLE_QUERIES = [
+    "What's our vacation policy for 2024?",
+    "How many remote work days do we have?",
+    "What's the deductible for health insurance?",
+    "How much does the Pro plan cost?",
+    "What new features launched recently?",
+    "Is there any current promotion?",
+    "What are the expense limits for meals?",
+    "When are performance reviews?",
+    "What company events are coming up?",
+    "Who are the founders?",
+    "How do I get promoted?",
+    "Who should I contact in HR?",
+]
+
+
+def configure_offline_app(**env):
+    """Point the app at the fake LLM backend (and keep synthetic traffic out of the query log)"""
+    os.environ.setdefault('LLM_BACKEND', 'fake')
+    os.environ.setdefault('QUERY_LOG_ENABLED', 'false')
+    for key, value in env.items():
+        if value is not None:
+            os.environ[key] = str(value)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(seconds):
+    """Latency summary in milliseconds"""
+    if not seconds:
+        return {'count': 0}
+    ms = [s * 1000 for s in seconds]
+    return {
+        'count': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 4),
+        'p50_ms': round(percentile(ms, 50), 4),
+        'p95_ms': round(percentile(ms, 95), 4),
+        'p99_ms': round(percentile(ms, 99), 4),
+        'max_ms': round(max(ms), 4),
+    }
+
+
+def synthetic_knowledge_base(base, size, seed=0):
+    """Grow a ``{doc: info}`` knowledge base to ``size`` entries by mixing base documents with filler vocabulary"""
+    if size <= len(base):
+        return dict(list(base.items())[:size])
+    rng = random.Random(seed)
+    vocabulary = [f"term{n}" for n in range(max(1000, size // 5))]
+    items = list(base.items())
+    knowledge_base = dict(items)
+    n = 0
+    while len(knowledge_base) < size:
+        doc, info = items[n % len(items)]
+        filler = ' '.join(rng.choice(vocabulary) for _ in range(30))
+        knowledge_base[f"{doc} {n}"] = {
+            'content': f"{info['content']} {filler}",
+            'source': info['source'],
+            'last_updated': info['last_updated'],
+        }
+        n += 1
+    return knowledge_base
+
+
+def write_results(name, results, output=None):
+    """Print results as JSON and optionally write them to ``output``"""
+    report = {
+        'benchmark': name,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    return report
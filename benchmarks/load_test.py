@@ -0,0 +1,121 @@
+"""End-to-end load generator for /ask.
+
+By default it starts the app in-process on a random port with the fake
+LLM backend, so no API key or network is needed:
+
+    python -m benchmarks.load_test --requests 500 --concurrency 32 --latency 0.2 --output bench/load.json
+
+Use --url to target an already running server instead.
+"""
+import argparse
+import itertools
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.common import SAMPLE_QUERIES, configure_offline_app, summarize, write_results
+
+
+def start_local_server():
+    """Serve the app from a background thread and return its base URL"""
+    from werkzeug.serving import make_server
+    import app
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def send(url, path, query, timeout):
+    """POST one question; return (ok, seconds)"""
+    data = urllib.parse.urlencode({'query': query}).encode('utf-8')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url + path, data=data, timeout=timeout) as response:
+            body = response.read()
+            ok = response.status == 200 and not body.startswith(b'{"error"')
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def run(url, path, total, concurrency, timeout, unique_queries):
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, failures = [], []
+
+    def worker():
+        while True:
+            n = next(counter)
+            if n >= total:
+                return
+            query = SAMPLE_QUERIES[n % len(SAMPLE_QUERIES)]
+            if unique_queries:
+                query = f"{query} #{n}"
+            ok, seconds = send(url, path, query, timeout)
+            with lock:
+                (latencies if ok else failures).append(seconds)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'url': url + path,
+        'requests': total,
+        'concurrency': concurrency,
+        'succeeded': len(latencies),
+        'failed': len(failures),
+        'duration_seconds': round(elapsed, 3),
+        'requests_per_second': round(total / elapsed, 2) if elapsed else None,
+        'latency': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server (default: start one in-process)')
+    parser.add_argument('--path', default='/ask')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake LLM latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05, help='fake LLM latency jitter in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fake LLM failure probability')
+    parser.add_argument('--enable-cache', action='store_true', help='keep the answer caches on')
+    parser.add_argument('--unique-queries', action='store_true', help='make every query distinct')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        configure_offline_app(
+            FAKE_LLM_LATENCY=args.latency,
+            FAKE_LLM_JITTER=args.jitter,
+            FAKE_LLM_FAILURE_RATE=args.failure_rate,
+            RESPONSE_CACHE_BACKEND=None if args.enable_cache else 'off',
+            SEMANTIC_CACHE_ENABLED=None if args.enable_cache else 'false',
+        )
+        url, server = start_local_server()
+
+    try:
+        results = run(url.rstrip('/'), args.path, args.requests, args.concurrency, args.timeout, args.unique_queries)
+    finally:
+        if server is not None:
+            server.shutdown()
+    results['fake_backend'] = None if args.url else {
+        'latency': args.latency, 'jitter': args.jitter, 'failure_rate': args.failure_rate,
+        'cache_enabled': args.enable_cache,
+    }
+    write_results('load_test', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
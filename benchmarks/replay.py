@@ -0,0 +1,152 @@
+"""Replay a captured query log against the app at a configurable rate.
+
+Requests are sent at their original relative times divided by --speed,
+so --speed 2 replays an hour of traffic in 30 minutes with the same
+shape (bursts, repeated questions). --speed 0 sends them back to back.
+By default the app is started in-process with the fake LLM backend and
+query logging turned off:
+
+    python -m benchmarks.replay --log requests.jsonl --speed 5 --output bench/replay.json
+
+Use --url to target an already running server instead.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import configure_offline_app, summarize, write_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_request(url, entry):
+    """Turn a log entry back into a ``urllib`` request for the same endpoint"""
+    endpoint = entry.get('endpoint', 'ask_question')
+    if endpoint == 'ask_batch':
+        payload = json.dumps({'queries': entry['queries']}).encode('utf-8')
+        return urllib.request.Request(url + '/api/ask/batch', data=payload, headers={'Content-Type': 'application/json'})
+    query = urllib.parse.urlencode({'query': entry['query']})
+    if endpoint == 'ask_stream':
+        return urllib.request.Request(f"{url}/ask/stream?{query}")
+    if endpoint == 'ask_direct':
+        return urllib.request.Request(f"{url}/ask/direct?{query}")
+    return urllib.request.Request(url + '/ask', data=query.encode('utf-8'))
+
+
+def send(request, timeout):
+    """Send one request and read the whole body; return (status, seconds)"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 'error'
+    return status, time.perf_counter() - started
+
+
+def run(url, entries, speed, workers, timeout):
+    entries = sorted(entries, key=lambda entry: entry['ts'])
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    statuses = Counter()
+    lags = []
+
+    def replay(entry, scheduled):
+        lag = time.perf_counter() - scheduled
+        status, seconds = send(build_request(url, entry), timeout)
+        with lock:
+            lags.append(max(lag, 0.0))
+            statuses[str(status)] += 1
+            if status == 200:
+                latencies[entry.get('endpoint', 'ask_question')].append(seconds)
+
+    first_ts = entries[0]['ts'] if entries else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry in entries:
+            scheduled = started + ((entry['ts'] - first_ts) / speed if speed > 0 else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(replay, entry, scheduled)
+    elapsed = time.perf_counter() - started
+
+    original = [entry['total_ms'] / 1000 for entry in entries if isinstance(entry.get('total_ms'), (int, float))]
+    return {
+        'url': url,
+        'requests': len(entries),
+        'speed': speed,
+        'workers': workers,
+        'captured_span_seconds': round(entries[-1]['ts'] - first_ts, 3) if entries else 0,
+        'duration_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(entries) / elapsed, 2) if elapsed else None,
+        'statuses': dict(statuses),
+        'latency': {endpoint: summarize(values) for endpoint, values in latencies.items()},
+        'captured_latency': summarize(original),
+        'schedule_lag': summarize(lags),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log', default=os.path.join(ROOT, 'requests.jsonl'),
+                        help='query log to replay (rotated .1, .2, ... files are included)')
+    parser.add_argument('--url', help='base URL of a running server (default: start one in-process)')
+    parser.add_argument('--speed', type=float, default=1.0, help='rate multiplier; 0 replays back to back')
+    parser.add_argument('--limit', type=int, help='replay at most this many entries')
+    parser.add_argument('--workers', type=int, default=64, help='maximum requests in flight')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake LLM latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05, help='fake LLM latency jitter in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fake LLM failure probability')
+    parser.add_argument('--disable-cache', action='store_true', help='turn the answer caches off')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    configure_offline_app()
+    from query_log import read_log
+
+    entries = list(read_log(args.log))
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        parser.error(f"no query log entries found in {args.log}")
+
+    server = None
+    url = args.url
+    if not url:
+        configure_offline_app(
+            FAKE_LLM_LATENCY=args.latency,
+            FAKE_LLM_JITTER=args.jitter,
+            FAKE_LLM_FAILURE_RATE=args.failure_rate,
+            RESPONSE_CACHE_BACKEND='off' if args.disable_cache else None,
+            SEMANTIC_CACHE_ENABLED='false' if args.disable_cache else None,
+            )
+        from benchmarks.load_test import start_local_server
+        url, server = start_local_server()
+
+    try:
+        results = run(url.rstrip('/'), entries, args.speed, args.workers, args.timeout)
+    finally:
+        if server is not None:
+            server.shutdown()
+    results['log'] = args.log
+    results['fake_backend'] = None if args.url else {
+        'latency': args.latency, 'jitter': args.jitter, 'failure_rate': args.failure_rate,
+        'cache_enabled': not args.disable_cache,
+    }
+    write_results('replay', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import collections
+import random
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a model whose breaker is open"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the caller's deadline, not the model, cut a call short.
+
+    Not a sign of an unhealthy model, so it is kept out of the breaker and
+    the model registry.
+    """
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker for one upstream model.
+
+    The outcome of the last ``window`` calls is kept. Once at least
+    ``min_calls`` are recorded, the breaker opens when the failure rate
+    reaches ``error_rate`` or the share of calls slower than
+    ``slow_call_seconds`` reaches ``slow_rate``. While open, calls are
+    refused immediately. After ``open_seconds`` it goes half-open and lets
+    ``half_open_calls`` trial calls through: a success closes it, a failure
+    reopens it. A trial that never reports back (e.g. an abandoned stream)
+    frees its slot after another ``open_seconds``.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, window=20, min_calls=5, error_rate=0.5, slow_call_seconds=10.0, slow_rate=0.8,
+                 open_seconds=30.0, half_open_calls=1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trials = []
+        self._reason = None
+
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def _refresh_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._trials = []
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def is_open(self):
+        """True while calls would be refused (no side effects, unlike ``before_call``)"""
+        return self.state == self.OPEN
+
+    def before_call(self):
+        """Admit a call or raise ``CircuitOpen``"""
+        now = time.monotonic()
+        with self._lock:
+            self._refresh_state(now)
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN:
+                self._trials = [t for t in self._trials if now - t < self.open_seconds]
+                if len(self._trials) < self.half_open_calls:
+                    self._trials.append(now)
+                    return
+            self.rejected += 1
+        raise CircuitOpen(f"Circuit open for {self.name}: {self._reason}")
+
+    def release_trial(self):
+        """Give back a half-open trial slot for a call that ended without an outcome (e.g. the caller's deadline)"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trials:
+                self._trials.pop()
+
+    def _trip(self, now, reason):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._reason = reason
+        self._outcomes.clear()
+        self.opened += 1
+
+    def record_success(self, seconds):
+        now = time.monotonic()
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            self.calls += 1
+            if self._state == self.HALF_OPEN:
+                if slow:
+                    self._trip(now, f"trial call took {seconds:.1f}s")
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate(now)
+
+    def record_failure(self, seconds, error=None):
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            if self._state == self.HALF_OPEN:
+                self._trip(now, f"trial call failed: {error}")
+                return
+            self._outcomes.append((True, seconds >= self.slow_call_seconds))
+            self._evaluate(now, error)
+
+    def _evaluate(self, now, error=None):
+        if self._state != self.CLOSED or len(self._outcomes) < self.min_calls:
+            return
+        total = len(self._outcomes)
+        failed = sum(1 for failure, _ in self._outcomes if failure)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if failed / total >= self.error_rate:
+            self._trip(now, f"{failed}/{total} recent calls failed" + (f" (last: {error})" if error else ""))
+        elif slow / total >= self.slow_rate:
+            self._trip(now, f"{slow}/{total} recent calls slower than {self.slow_call_seconds}s")
+
+    def stats(self):
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return {
+                'state': self._state,
+                'reason': self._reason if self._state != self.CLOSED else None,
+                'calls': self.calls,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+            }
+
+
+class CircuitBreakers:
+    """One ``CircuitBreaker`` per model name, created on first use"""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name, **self.settings))
+        return breaker
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in list(self._breakers.items())}
+
+
+def backoff_delay(attempt, base=0.2, cap=2.0):
+    """Full-jitter exponential backoff for retry ``attempt`` (1-based)"""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
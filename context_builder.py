@@ -0,0 +1,105 @@
+import hashlib
+import re
+
+_WORD = re.compile(r"\w+")
+
+CONTEXT_HEADER = "RETRIEVED COMPANY KNOWLEDGE:"
+NO_CONTEXT = "No specific company documents found for this query."
+DOCUMENT_TEMPLATE = "\nDOCUMENT {index}: {title}\nSOURCE: {source}\nCONTENT: {content}\n"
+TRUNCATION_MARKER = " [...]"
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+def _shingles(text, size=5):
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _truncate_to_tokens(text, tokens):
+    limit = max(0, tokens * 4 - len(TRUNCATION_MARKER))
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip() + TRUNCATION_MARKER
+
+
+class ContextResult:
+    """Assembled context text plus accounting for the token budget"""
+
+    __slots__ = ('text', 'documents', 'tokens', 'tokens_saved', 'duplicates', 'dropped', 'truncated')
+
+    def __init__(self, text, documents, tokens, tokens_saved, duplicates, dropped, truncated):
+        self.text = text
+        self.documents = documents
+        self.tokens = tokens
+        self.tokens_saved = tokens_saved
+        self.duplicates = duplicates
+        self.dropped = dropped
+        self.truncated = truncated
+
+
+def build_context(retrieved_info, token_budget=1500, dedup_threshold=0.8):
+    """Rank, dedup and pack retrieved chunks into ``token_budget`` tokens.
+
+    Chunks are taken in descending score order. A chunk whose content is
+    identical to, or shares more than ``dedup_threshold`` of its 5-word
+    shingles with, an already selected chunk is skipped. Chunks that do not
+    fit the remaining budget are skipped too, except the best chunk, which
+    is truncated rather than dropped so the prompt is never empty.
+    ``tokens_saved`` compares against formatting every chunk unconditionally.
+    """
+    if not retrieved_info:
+        return ContextResult(NO_CONTEXT, [], estimate_tokens(NO_CONTEXT), 0, 0, 0, False)
+
+    ranked = sorted(retrieved_info, key=lambda info: info.get('score', 0), reverse=True)
+    header_tokens = estimate_tokens(CONTEXT_HEADER)
+    naive_tokens = header_tokens
+    remaining = token_budget - header_tokens
+
+    parts = [CONTEXT_HEADER]
+    selected, selected_shingles, seen_hashes = [], [], set()
+    duplicates = dropped = 0
+    truncated = False
+
+    for info in ranked:
+        block = DOCUMENT_TEMPLATE.format(index=len(selected) + 1, title=info['title'],
+                                         source=info['source'], content=info['content'])
+        block_tokens = estimate_tokens(block)
+        naive_tokens += block_tokens
+
+        digest = hashlib.blake2b(info['content'].strip().lower().encode('utf-8'), digest_size=16).digest()
+        if digest in seen_hashes:
+            duplicates += 1
+            continue
+        shingles = _shingles(info['content'])
+        if shingles and any(len(shingles & other) > dedup_threshold * min(len(shingles), len(other))
+                            for other in selected_shingles):
+            duplicates += 1
+            continue
+
+        if block_tokens > remaining:
+            if selected:
+                dropped += 1
+                continue
+            overhead = block_tokens - estimate_tokens(info['content'])
+            content = _truncate_to_tokens(info['content'], max(remaining - overhead, 0))
+            block = DOCUMENT_TEMPLATE.format(index=1, title=info['title'],
+                                             source=info['source'], content=content)
+            block_tokens = estimate_tokens(block)
+            truncated = True
+
+        parts.append(block)
+        remaining -= block_tokens
+        selected.append(info)
+        selected_shingles.append(shingles)
+        seen_hashes.add(digest)
+
+    text = "\n".join(parts)
+    tokens = estimate_tokens(text)
+    return ContextResult(text, selected, tokens, max(naive_tokens - tokens, 0), duplicates, dropped, truncated)
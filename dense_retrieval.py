@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import zlib
+
+import numpy as np
+
+from retrieval import tokenize
+
+
+class HashingEmbedder:
+    """Offline text embedder based on hashed n-gram TF-IDF projections.
+
+    Word unigrams, word bigrams and character trigrams are hashed into a
+    fixed number of dimensions with a signed CRC32 hash (stable across
+    processes, unlike ``hash()``), weighted by sublinear TF and a per-bucket
+    IDF learned in ``fit``, and L2-normalised so a dot product is a cosine.
+    """
+
+    def __init__(self, dim=1024, idf=None, char_ngrams=True):
+        self.dim = dim
+        self.idf = idf if idf is not None else np.ones(dim, dtype=np.float32)
+        self.char_ngrams = char_ngrams
+
+    def features(self, text):
+        tokens = tokenize(text)
+        feats = list(tokens)
+        feats.extend(f"{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+        if not self.char_ngrams:
+            return feats
+        for token in tokens:
+            padded = f"#{token}#"
+            feats.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return feats
+
+    def _buckets(self, text):
+        counts = {}
+        for feat in self.features(text):
+            h = zlib.crc32(feat.encode('utf-8'))
+            bucket = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            counts[bucket] = counts.get(bucket, 0.0) + sign
+        return counts
+
+    def fit(self, texts, drop_unseen=False):
+        """Learn per-bucket IDF weights from the corpus.
+
+        With ``drop_unseen`` buckets that never occur in the corpus get zero
+        weight, so query words the corpus knows nothing about are ignored.
+        """
+        df = np.zeros(self.dim, dtype=np.float64)
+        n = 0
+        for text in texts:
+            n += 1
+            for bucket in self._buckets(text):
+                df[bucket] += 1
+        idf = np.log((1 + n) / (1 + df)) + 1.0
+        if drop_unseen:
+            idf[df == 0] = 0.0
+        self.idf = idf.astype(np.float32)
+        return self
+
+    def embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for bucket, value in self._buckets(text).items():
+            vec[bucket] = math.copysign(1 + math.log(abs(value)), value) if value else 0.0
+        vec *= self.idf
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+        return vec
+
+    def embed_many(self, texts):
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self.embed(text)
+        return matrix
+
+
+class DenseIndex:
+    """Contiguous float32 embedding matrix scored with one matrix-vector product"""
+
+    def __init__(self, ids, matrix, embedder, fingerprint=None):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.embedder = embedder
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, documents, dim=1024, fingerprint=None):
+        """Build from ``{doc_id: text}``"""
+        ids = list(documents)
+        texts = [documents[doc_id] for doc_id in ids]
+        embedder = HashingEmbedder(dim).fit(texts)
+        matrix = np.ascontiguousarray(embedder.embed_many(texts), dtype=np.float32)
+        return cls(ids, matrix, embedder, fingerprint)
+
+    def updated(self, removed_ids=(), documents=None):
+        """Return a new index without ``removed_ids`` and with ``documents`` re-embedded.
+
+        Rows for untouched documents are copied from the existing matrix, so
+        only new or changed texts are embedded. The IDF weights are kept
+        from the last full build.
+        """
+        documents = documents or {}
+        drop = set(removed_ids) | set(documents)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in drop]
+        ids = [self.ids[row] for row in keep] + list(documents)
+        new_rows = self.embedder.embed_many(documents[doc_id] for doc_id in documents)
+        matrix = np.concatenate([np.asarray(self.matrix[keep], dtype=np.float32), new_rows])
+        return DenseIndex(ids, np.ascontiguousarray(matrix), self.embedder, self.fingerprint)
+
+    def score(self, query):
+        """Return a ``(scores, query_vector)`` pair for every row"""
+        if not self.ids:
+            return np.zeros(0, dtype=np.float32), None
+        q = self.embedder.embed(query)
+        return self.matrix @ q, q
+
+    def search(self, query, k=5, min_score=0.0):
+        """Return the top ``k`` ``(doc_id, score)`` pairs scoring above ``min_score``"""
+        scores, _ = self.score(query)
+        n = len(scores)
+        if not n:
+            return []
+        k = min(k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if scores[i] > min_score]
+
+    def save(self, directory):
+        """Persist the matrix as ``.npy`` plus ids/IDF metadata, atomically"""
+        os.makedirs(directory, exist_ok=True)
+        matrix_path = os.path.join(directory, 'embeddings.npy')
+        idf_path = os.path.join(directory, 'idf.npy')
+        meta_path = os.path.join(directory, 'meta.json')
+        pid = os.getpid()
+        for path, array in ((matrix_path, self.matrix), (idf_path, self.embedder.idf)):
+            tmp = f"{path}.{pid}.tmp.npy"
+            np.save(tmp, np.ascontiguousarray(array, dtype=np.float32))
+            os.replace(tmp, path)
+        tmp = f"{meta_path}.{pid}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'dim': self.embedder.dim,
+                       'fingerprint': self.fingerprint}, f)
+        os.replace(tmp, meta_path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a saved index; the matrix is memory-mapped read-only by default"""
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        matrix = np.load(os.path.join(directory, 'embeddings.npy'), mmap_mode='r' if mmap else None)
+        idf = np.load(os.path.join(directory, 'idf.npy'))
+        if matrix.shape != (len(meta['ids']), meta['dim']):
+            raise ValueError(f"Corrupt dense index in {directory}: shape {matrix.shape}")
+        return cls(meta['ids'], matrix, HashingEmbedder(meta['dim'], idf), meta.get('fingerprint'))
+
+    @classmethod
+    def load_or_build(cls, directory, documents, dim=1024, fingerprint=None):
+        """Reuse a persisted index when its fingerprint matches, otherwise rebuild and save"""
+        if directory:
+            try:
+                index = cls.load(directory)
+                if index.embedder.dim == dim and (fingerprint is None or index.fingerprint == fingerprint):
+                    return index
+            except (OSError, ValueError, KeyError):
+                pass
+        index = cls.build(documents, dim=dim, fingerprint=fingerprint)
+        if directory:
+            index.save(directory)
+            return cls.load(directory)
+        return index
+
+
+def fuse_scores(keyword_results, dense_results, alpha=0.5, k=5):
+    """Blend max-normalised keyword and dense scores: ``alpha`` weights the dense side"""
+    fused = {}
+    for results, weight in ((keyword_results, 1 - alpha), (dense_results, alpha)):
+        if not results:
+            continue
+        best = max(score for _, score in results) or 1.0
+        for doc_id, score in results:
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight * score / best
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:k]
@@ -0,0 +1,418 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+from datetime import date
+
+from retrieval import BM25Index
+from dense_retrieval import DenseIndex
+
+SUPPORTED_EXTENSIONS = ('.md', '.markdown', '.jsonl')
+FRONT_MATTER_PATTERN = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+
+
+def file_digest(path, block_size=65536):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_doc_key(doc_id):
+    """'hr/vacation-policy' -> 'vacation policy', used to attach synonym phrases"""
+    name = doc_id.split('#', 1)[0].rsplit('/', 1)[-1]
+    return re.sub(r"[-_\s]+", ' ', name).strip().lower()
+
+
+def parse_front_matter(text):
+    """Split optional ``key: value`` front matter from a Markdown body"""
+    match = FRONT_MATTER_PATTERN.match(text)
+    if not match:
+        return {}, text
+    meta = {}
+    for line in match.group(1).splitlines():
+        if ':' in line:
+            key, value = line.split(':', 1)
+            meta[key.strip().lower()] = value.strip().strip('"\'')
+    return meta, text[match.end():]
+
+
+def _split_keywords(value):
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return [v.strip() for v in str(value or '').split(',') if v.strip()]
+
+
+def iter_file_documents(path, rel_path):
+    """Yield the documents stored in one Markdown or JSONL file (malformed JSONL lines are skipped)"""
+    stem = os.path.splitext(rel_path)[0].replace(os.sep, '/')
+    mtime_date = date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if not isinstance(entry, dict):
+                        raise ValueError("expected a JSON object")
+                    if not isinstance(entry.get('content', ''), str):
+                        raise ValueError("\"content\" must be a string")
+                except ValueError as e:
+                    print(f"⚠️  Skipping line {line_no} of knowledge file {rel_path}: {e}")
+                    continue
+                doc_id = f"{stem}/{entry.get('id') or line_no}"
+                yield {
+                    'id': doc_id,
+                    'title': str(entry.get('title') or normalize_doc_key(doc_id).title()),
+                    'content': entry.get('content', ''),
+                    'source': str(entry.get('source') or os.path.basename(path)),
+                    'last_updated': str(entry.get('last_updated') or mtime_date),
+                    'keywords': _split_keywords(entry.get('keywords')),
+                }
+        return
+
+    with open(path, encoding='utf-8') as f:
+        meta, body = parse_front_matter(f.read())
+    title = meta.get('title')
+    if not title:
+        heading = re.search(r"^#\s+(.+)$", body, re.MULTILINE)
+        title = heading.group(1).strip() if heading else normalize_doc_key(stem).title()
+    yield {
+        'id': stem,
+        'title': title,
+        'content': body.strip(),
+        'source': meta.get('source') or os.path.basename(path),
+        'last_updated': meta.get('last_updated') or mtime_date,
+        'keywords': _split_keywords(meta.get('keywords')),
+    }
+
+
+def chunk_document(document, max_chars=1200):
+    """Pack paragraphs into chunks of at most ``max_chars`` that keep the document metadata"""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", document['content']) if p.strip()]
+    pieces = []
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            pieces.append(paragraph)
+
+    chunks, current = [], ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current or not chunks:
+        chunks.append(current)
+
+    for n, text in enumerate(chunks):
+        yield f"{document['id']}#{n}", {
+            'content': text,
+            'source': document['source'],
+            'last_updated': document['last_updated'],
+            'title': document['title'] if len(chunks) == 1 else f"{document['title']} (part {n + 1})",
+            'doc_id': document['id'],
+            'keywords': document['keywords'],
+        }
+
+
+class KnowledgeSnapshot:
+    """Immutable view of the knowledge base and the indexes built from it.
+
+    Request handlers read ``store.current`` once and use that snapshot for
+    the whole request, so a re-index can swap in a new one at any time.
+    """
+
+    def __init__(self, knowledge_base, keyword_index, manifest, version, dense_index=None):
+        self.knowledge_base = knowledge_base
+        self.keyword_index = keyword_index
+        self.manifest = manifest
+        self.version = version
+        self.dense_index = dense_index
+
+
+class KnowledgeStore:
+    """Chunked knowledge base loaded from a directory, re-indexed incrementally.
+
+    A manifest records each file's mtime, size, content hash and chunk ids.
+    ``sync`` only stats files whose mtime/size are unchanged, hashes the rest,
+    and re-chunks just the added/modified files (and drops deleted ones)
+    before atomically swapping in a new snapshot. Snapshots are pickled to
+    ``snapshot_path`` so other workers and restarts skip the full rebuild.
+    """
+
+    def __init__(self, directory=None, snapshot_path=None, dense_dir=None, synonyms=None,
+                 chunk_chars=1200, build_dense=False, dense_dim=1024):
+        self.directory = directory
+        self.snapshot_path = snapshot_path
+        self.dense_dir = dense_dir
+        self.synonyms = synonyms or {}
+        self.chunk_chars = chunk_chars
+        self.build_dense = build_dense
+        self.dense_dim = dense_dim
+
+        self._current = None
+        self._sync_lock = threading.Lock()
+        self._watcher = None
+        self._listeners = []
+        self.reindexed_files = 0
+        self.syncs = 0
+
+    @property
+    def current(self):
+        return self._current
+
+    @classmethod
+    def from_dict(cls, knowledge_base, **kwargs):
+        """Build a static store from an in-code ``{doc: info}`` mapping"""
+        store = cls(**kwargs)
+        chunks = {}
+        for doc, info in knowledge_base.items():
+            chunks[doc] = {
+                'content': info['content'],
+                'source': info['source'],
+                'last_updated': info['last_updated'],
+                'title': doc.replace('_', ' ').title(),
+                'doc_id': doc,
+                'keywords': [],
+            }
+        digest = hashlib.sha256()
+        for doc in sorted(chunks):
+            info = chunks[doc]
+            digest.update(f"{doc}\0{info['content']}\0{info['last_updated']}\0".encode('utf-8'))
+        manifest = {'<builtin>': {'hash': digest.hexdigest(), 'chunks': sorted(chunks)}}
+        store._swap(store._build_snapshot(chunks, manifest))
+        return store
+
+    # -- index construction -------------------------------------------------
+
+    def _index_chunk(self, index, chunk_id, info):
+        index.add(chunk_id, info['content'], title=info['title'])
+        phrases = list(info.get('keywords') or ())
+        phrases.extend(self.synonyms.get(normalize_doc_key(info['doc_id']), ()))
+        if phrases:
+            index.add_synonyms(chunk_id, phrases)
+
+    @staticmethod
+    def _dense_text(chunk_id, info):
+        return f"{info['title']}. {info['content']}"
+
+    @staticmethod
+    def _version(manifest):
+        digest = hashlib.sha256()
+        for path in sorted(manifest):
+            digest.update(f"{path}\0{manifest[path]['hash']}\0".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _dense_path(self, version):
+        return os.path.join(self.dense_dir, version[:16]) if self.dense_dir else None
+
+    def _build_snapshot(self, knowledge_base, manifest):
+        index = BM25Index()
+        for chunk_id, info in knowledge_base.items():
+            self._index_chunk(index, chunk_id, info)
+        version = self._version(manifest)
+        dense = None
+        if self.build_dense:
+            documents = {cid: self._dense_text(cid, info) for cid, info in knowledge_base.items()}
+            dense = DenseIndex.load_or_build(self._dense_path(version), documents,
+                                             dim=self.dense_dim, fingerprint=version)
+        return KnowledgeSnapshot(knowledge_base, index, manifest, version, dense)
+
+    # -- persistence --------------------------------------------------------
+
+    def _save_snapshot(self, snapshot):
+        if not self.snapshot_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({'knowledge_base': snapshot.knowledge_base,
+                         'keyword_index': snapshot.keyword_index,
+                         'manifest': snapshot.manifest,
+                         'version': snapshot.version}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.snapshot_path)
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable knowledge snapshot {self.snapshot_path}: {e}")
+            return None
+        dense = None
+        if self.build_dense:
+            try:
+                dense = DenseIndex.load(self._dense_path(data['version']))
+            except (OSError, ValueError, KeyError):
+                documents = {cid: self._dense_text(cid, info) for cid, info in data['knowledge_base'].items()}
+                dense = DenseIndex.load_or_build(self._dense_path(data['version']), documents,
+                                                 dim=self.dense_dim, fingerprint=data['version'])
+        return KnowledgeSnapshot(data['knowledge_base'], data['keyword_index'],
+                                 data['manifest'], data['version'], dense)
+
+    def _prune_dense(self, keep_versions):
+        if not self.dense_dir or not os.path.isdir(self.dense_dir):
+            return
+        keep = {v[:16] for v in keep_versions if v}
+        for name in os.listdir(self.dense_dir):
+            path = os.path.join(self.dense_dir, name)
+            if name not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _swap(self, snapshot):
+        # Scoring arrays are built here, by the syncing thread, not by the first query
+        snapshot.keyword_index.compile()
+        self._current = snapshot
+        for callback in list(self._listeners):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"⚠️  Knowledge snapshot listener failed: {e}")
+
+    def on_swap(self, callback):
+        """Call ``callback(snapshot)`` after every new snapshot is swapped in (from the syncing thread)"""
+        self._listeners.append(callback)
+
+    # -- loading and incremental sync ---------------------------------------
+
+    def load(self):
+        """Load the persisted snapshot if present, then bring it up to date"""
+        snapshot = self._load_snapshot()
+        if snapshot is not None:
+            self._swap(snapshot)
+        self.sync()
+        return self.current
+
+    def _scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(names):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    files[os.path.relpath(path, self.directory)] = path
+        return files
+
+    def sync(self):
+        """Re-index only added, modified or deleted files; return True if anything changed"""
+        if not self.directory:
+            return False
+        with self._sync_lock:
+            self.syncs += 1
+            old = self.current
+            old_manifest = old.manifest if old else {}
+            files = self._scan()
+
+            manifest, changed = {}, {}
+            for rel_path, path in files.items():
+                stat = os.stat(path)
+                entry = old_manifest.get(rel_path)
+                if entry and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+                    manifest[rel_path] = entry
+                    continue
+                digest = file_digest(path)
+                if entry and entry['hash'] == digest:
+                    manifest[rel_path] = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+                    continue
+                changed[rel_path] = (path, stat, digest)
+            deleted = [rel_path for rel_path in old_manifest if rel_path not in files]
+
+            if old is not None and not changed and not deleted:
+                if manifest != old_manifest:
+                    old.manifest = manifest
+                return False
+
+            removed_ids = set()
+            for rel_path in deleted + list(changed):
+                removed_ids.update(old_manifest.get(rel_path, {}).get('chunks', ()))
+
+            added = {}
+            for rel_path, (path, stat, digest) in changed.items():
+                chunks = {}
+                try:
+                    for document in iter_file_documents(path, rel_path):
+                        chunks.update(chunk_document(document, self.chunk_chars))
+                except Exception as e:
+                    # One bad file must not block re-indexing the rest; it is
+                    # retried once it changes again
+                    print(f"⚠️  Skipping knowledge file {rel_path}: {e}")
+                    chunks = {}
+                added.update(chunks)
+                manifest[rel_path] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                                      'hash': digest, 'chunks': list(chunks)}
+
+            if old is None:
+                snapshot = self._build_snapshot(added, manifest)
+            else:
+                knowledge_base = {cid: info for cid, info in old.knowledge_base.items()
+                                  if cid not in removed_ids}
+                knowledge_base.update(added)
+                index = old.keyword_index.copy()
+                for chunk_id in removed_ids:
+                    index.remove(chunk_id)
+                for chunk_id, info in added.items():
+                    self._index_chunk(index, chunk_id, info)
+                version = self._version(manifest)
+                dense = None
+                if old.dense_index is not None:
+                    dense = old.dense_index.updated(
+                        removed_ids,
+                        {cid: self._dense_text(cid, info) for cid, info in added.items()})
+                    dense.fingerprint = version
+                    path = self._dense_path(version)
+                    if path:
+                        dense.save(path)
+                        dense = DenseIndex.load(path)
+                snapshot = KnowledgeSnapshot(knowledge_base, index, manifest, version, dense)
+
+            self._save_snapshot(snapshot)
+            self._swap(snapshot)
+            if self.build_dense:
+                self._prune_dense([snapshot.version, old.version if old else None])
+            self.reindexed_files += len(changed) + len(deleted)
+            print(f"📚 Knowledge base re-indexed: {len(changed)} changed, {len(deleted)} deleted, "
+                  f"{len(snapshot.knowledge_base)} chunks")
+            return True
+
+    def start_watcher(self, interval=30):
+        """Poll the directory for changes from a daemon thread"""
+        if not self.directory or self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            stop = threading.Event()
+            while not stop.wait(interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"⚠️  Knowledge base sync failed: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="knowledge-watcher", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        snapshot = self.current
+        return {
+            'directory': self.directory,
+            'version': snapshot.version[:16] if snapshot else None,
+            'chunks': len(snapshot.knowledge_base) if snapshot else 0,
+            'files': len(snapshot.manifest) if snapshot else 0,
+            'syncs': self.syncs,
+            'reindexed_files': self.reindexed_files,
+        }
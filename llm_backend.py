@@ -0,0 +1,219 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from circuit_breaker import DeadlineExceeded
+
+# Errors saying the model itself cannot be used right now, whatever the request
+UNAVAILABLE_ERRORS = (google_exceptions.NotFound, google_exceptions.PermissionDenied, google_exceptions.Unauthenticated,
+                      google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded, ConnectionError,
+                      TimeoutError)
+
+
+def is_availability_error(error):
+    """True if ``error`` means the model is missing, forbidden, unavailable or timing out.
+
+    Request-specific errors (a safety-blocked answer whose ``.text`` raises
+    ``ValueError``, an invalid argument, ...) are not, and neither is a call
+    cut short by the caller's deadline.
+    """
+    return isinstance(error, UNAVAILABLE_ERRORS) and not isinstance(error, DeadlineExceeded)
+
+
+# Errors a later attempt can plausibly get past: timeouts, 5xx, 429 and dropped connections
+RETRYABLE_ERRORS = (google_exceptions.ServerError, google_exceptions.TooManyRequests, ConnectionError, TimeoutError)
+
+
+def is_retryable_error(error):
+    """True if ``error`` is transient and says something about the model's health.
+
+    Anything else (a blocked answer, ``InvalidArgument``, a missing model)
+    fails the same way on every attempt, so it is neither retried nor
+    counted by the circuit breaker.
+    """
+    return isinstance(error, RETRYABLE_ERRORS) and not isinstance(error, DeadlineExceeded)
+
+
+class GeminiBackend:
+    """Google Gemini via ``google.generativeai``, configured once per process.
+
+    Model handles are cached per name, so the SDK's sync and async gRPC
+    clients (and their connection pools) are created once and shared.
+
+    The pinned SDK has no per-request timeout, so sync calls and streams
+    with a ``timeout`` run on a small pool and are abandoned (not cancelled)
+    when it expires; the caller gets ``TimeoutError`` right away.
+    """
+
+    name = 'gemini'
+
+    def __init__(self, api_key, call_workers=32):
+        self.api_key = api_key
+        self._models = {}
+        self._lock = threading.Lock()
+        self._calls = ThreadPoolExecutor(max_workers=call_workers, thread_name_prefix='gemini-call')
+        if api_key:
+            genai.configure(api_key=api_key)
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _model(self, model_name):
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.setdefault(model_name, genai.GenerativeModel(model_name))
+        return model
+
+    def generate(self, model_name, prompt, timeout=None):
+        """Return the full response text, raising ``TimeoutError`` after ``timeout`` seconds"""
+        model = self._model(model_name)
+        if timeout is None:
+            return model.generate_content(prompt).text
+        try:
+            return self._calls.submit(model.generate_content, prompt).result(timeout).text
+        except FutureTimeout:
+            raise TimeoutError(f"{model_name} did not answer within {timeout:.1f}s") from None
+
+    async def agenerate(self, model_name, prompt, timeout=None):
+        """Return the full response text without blocking the event loop"""
+        try:
+            response = await asyncio.wait_for(self._model(model_name).generate_content_async(prompt), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{model_name} did not answer within {timeout:.1f}s") from None
+        return response.text
+
+    def stream(self, model_name, prompt, timeout=None):
+        """Yield response text pieces as they arrive, raising ``TimeoutError`` once ``timeout`` seconds pass"""
+        model = self._model(model_name)
+        if timeout is None:
+            for chunk in model.generate_content(prompt, stream=True):
+                if chunk.text:
+                    yield chunk.text
+            return
+
+        pieces = queue.Queue()
+        abandoned = threading.Event()
+
+        def produce():
+            try:
+                for chunk in model.generate_content(prompt, stream=True):
+                    if abandoned.is_set():
+                        return
+                    if chunk.text:
+                        pieces.put(('text', chunk.text))
+                pieces.put(('done', None))
+            except Exception as e:
+                pieces.put(('error', e))
+
+        self._calls.submit(produce)
+        expires = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    kind, value = pieces.get(timeout=max(expires - time.monotonic(), 0))
+                except queue.Empty:
+                    raise TimeoutError(f"{model_name} did not finish streaming within {timeout:.1f}s") from None
+                if kind == 'done':
+                    return
+                if kind == 'error':
+                    raise value
+                yield value
+        finally:
+            abandoned.set()
+
+    def probe(self, model_name, timeout=None):
+        """Send a tiny request to check that a model is reachable"""
+        self.generate(model_name, "Say 'API test successful'", timeout)
+
+
+class FakeBackend:
+    """Local stand-in for Gemini with configurable latency, jitter and failure rate.
+
+    Used for offline benchmarks and load tests: no network, deterministic
+    answers derived from the prompt, and ``latency`` +/- ``jitter`` seconds
+    per call (spread over the pieces when streaming).
+    """
+
+    name = 'fake'
+    configured = True
+
+    def __init__(self, latency=0.5, jitter=0.1, failure_rate=0.0, stream_pieces=8, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.stream_pieces = stream_pieces
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay_and_maybe_fail(self, model_name):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+        return delay, fail
+
+    @staticmethod
+    def _answer(model_name, prompt):
+        question = ''
+        for line in prompt.splitlines():
+            if line.startswith('QUESTION:'):
+                question = line[len('QUESTION:'):].strip()
+        return (f"[{model_name} fake answer] Based on the provided information, here is a response to "
+                f"\"{question}\". This text is generated locally for benchmarking.")
+
+    def generate(self, model_name, prompt, timeout=None):
+        delay, fail = self._delay_and_maybe_fail(model_name)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"{model_name} did not answer within {timeout:.1f}s")
+        time.sleep(delay)
+        if fail:
+            raise google_exceptions.ServiceUnavailable("Fake backend injected failure")
+        return self._answer(model_name, prompt)
+
+    async def agenerate(self, model_name, prompt, timeout=None):
+        delay, fail = self._delay_and_maybe_fail(model_name)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"{model_name} did not answer within {timeout:.1f}s")
+        await asyncio.sleep(delay)
+        if fail:
+            raise google_exceptions.ServiceUnavailable("Fake backend injected failure")
+        return self._answer(model_name, prompt)
+
+    def stream(self, model_name, prompt, timeout=None):
+        delay, fail = self._delay_and_maybe_fail(model_name)
+        words = self._answer(model_name, prompt).split(' ')
+        per_piece = max(1, len(words) // self.stream_pieces)
+        pieces = [' '.join(words[i:i + per_piece]) + ' ' for i in range(0, len(words), per_piece)]
+        for n, piece in enumerate(pieces):
+            if timeout is not None and delay * (n + 1) / len(pieces) > timeout:
+                time.sleep(max(0.0, timeout - delay * n / len(pieces)))
+                raise TimeoutError(f"{model_name} did not finish streaming within {timeout:.1f}s")
+            time.sleep(delay / len(pieces))
+            if fail and n == len(pieces) // 2:
+                raise google_exceptions.ServiceUnavailable("Fake backend injected failure")
+            yield piece
+
+    def probe(self, model_name, timeout=None):
+        self.generate(model_name, "Say 'API test successful'", timeout)
+
+
+def create_backend(spec, api_key=None, **fake_options):
+    """Build the LLM backend named by ``spec`` ('gemini' or 'fake')"""
+    spec = (spec or 'gemini').strip().lower()
+    if spec == 'gemini':
+        return GeminiBackend(api_key)
+    if spec == 'fake':
+        return FakeBackend(**fake_options)
+    raise ValueError(f"Unknown LLM backend: {spec}")
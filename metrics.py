@@ -0,0 +1,255 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Per-request stage timings, collected for the optional Server-Timing header
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, key):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+class Registry:
+    """Holds metrics plus callbacks that expose existing stats dicts as gauges"""
+
+    def __init__(self):
+        self._metrics = []
+        self._gauge_callbacks = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, name, documentation, callback):
+        """Register ``callback() -> {label_dict_tuple_or_None: value}`` evaluated at scrape time"""
+        self._gauge_callbacks.append((name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, callback in self._gauge_callbacks:
+            try:
+                samples = callback()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples.items():
+                if value is None:
+                    continue
+                labels = labels or ()
+                lines.append(f"{name}{_format_labels([k for k, _ in labels], [v for _, v in labels])} "
+                             f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.histogram('rag_stage_duration_seconds', 'Latency of each request stage', ['stage'])
+STAGE_ERRORS = REGISTRY.counter('rag_stage_errors_total', 'Errors raised or reported by each stage', ['stage'])
+FALLBACKS = REGISTRY.counter('rag_fallback_responses_total', 'Answers served from the knowledge base fallback')
+RETRIEVED_DOCUMENTS = REGISTRY.histogram('rag_retrieved_documents', 'Documents returned per retrieval',
+                                         buckets=(0, 1, 2, 3, 5, 8, 13, 21))
+PROMPT_SIZE = REGISTRY.histogram('rag_prompt_chars', 'Prompt size in characters', ['kind'],
+                                 buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+CONTEXT_TOKENS = REGISTRY.histogram('rag_context_tokens', 'Estimated tokens of retrieved context per prompt',
+                                    buckets=(50, 100, 250, 500, 1000, 1500, 2000, 4000, 8000))
+CONTEXT_TOKENS_SAVED = REGISTRY.histogram('rag_context_tokens_saved',
+                                          'Estimated context tokens saved by ranking, dedup and the budget',
+                                          buckets=(0, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+LLM_RETRIES = REGISTRY.counter('rag_llm_retries_total', 'Upstream LLM calls retried after a failure', ['model'])
+REQUEST_LATENCY = REGISTRY.histogram('http_request_duration_seconds', 'HTTP request latency', ['endpoint'])
+
+
+def start_request_timing():
+    """Begin collecting stage timings for the current request context"""
+    return _request_timings.set({})
+
+
+def stop_request_timing(token):
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings or {}
+
+
+def record_stage(stage, seconds):
+    """Record one stage duration in the histogram and the per-request timings"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def instrumented(stage):
+    """Decorator: time calls into ``rag_stage_duration_seconds{stage=...}`` and count exceptions"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.labels(stage).inc()
+                raise
+            finally:
+                record_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def submit_with_context(pool, func, *args, **kwargs):
+    """Submit to a thread pool so the task records into the caller's request timings"""
+    return pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def iterate_with_context(iterable):
+    """Iterate inside a copy of the caller's context.
+
+    For streamed response bodies, which are consumed after the request hooks
+    have reset the per-request context variables.
+    """
+    context = contextvars.copy_context()
+
+    def run():
+        iterator = iter(iterable)
+        done = object()
+        while True:
+            item = context.run(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    return run()
+
+
+def server_timing_header(timings):
+    """Format stage timings as a ``Server-Timing`` header value (milliseconds)"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
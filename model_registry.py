@@ -0,0 +1,176 @@
+import threading
+import time
+
+
+class ModelRegistry:
+    """Resolve the best available Gemini model once and serve it from memory.
+
+    The registry probes the candidate models in order, caches the winner for
+    ``ttl`` seconds and refreshes it from a background thread, so request
+    handlers never pay for a probe round-trip. Real generation failures are
+    reported through ``mark_unhealthy`` which demotes the model for a cooldown
+    period and fails over to the next candidate without probing inline.
+
+    While no model resolves, the registry re-probes after
+    ``min(ttl, unhealthy_cooldown)`` seconds, doubling up to ``ttl`` on each
+    further miss, and as soon as a demoted model's cooldown runs out.
+    """
+
+    def __init__(self, candidates, probe, ttl=300, unhealthy_cooldown=60, ready_timeout=15):
+        self.candidates = list(candidates)
+        self._probe = probe
+        self.ttl = ttl
+        self.unhealthy_cooldown = unhealthy_cooldown
+        self.ready_timeout = ready_timeout
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._refresh_requested = threading.Event()
+        self._thread = None
+
+        self._model = None
+        self._valid = False
+        self._message = "Model health not checked yet"
+        self._checked_at = 0.0
+        self._unhealthy = {}
+        self._probe_failed = set()
+
+        self.probe_calls = 0
+        self.probes_avoided = 0
+        self.refreshes = 0
+
+    def start(self):
+        """Start the background refresher; the first resolution runs immediately"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        misses = 0
+        while True:
+            if self.refresh() is None:
+                misses += 1
+                interval = min(self.ttl, self.unhealthy_cooldown * 2 ** (misses - 1))
+            else:
+                misses = 0
+                interval = self.ttl
+            self._refresh_requested.wait(interval)
+            self._refresh_requested.clear()
+
+    def refresh(self):
+        """Probe the candidates in order and cache the first healthy one"""
+        first_error = None
+        resolved = None
+        failed = set()
+        now = time.time()
+        for name in self.candidates:
+            if self._unhealthy.get(name, 0) > now:
+                continue
+            try:
+                self.probe_calls += 1
+                self._probe(name)
+                resolved = name
+                break
+            except Exception as e:
+                failed.add(name)
+                if first_error is None:
+                    first_error = e
+
+        with self._lock:
+            self.refreshes += 1
+            self._checked_at = time.time()
+            self._model = resolved
+            self._probe_failed = failed
+            self._valid = resolved is not None
+            if resolved is None:
+                self._message = f"Model error: {first_error}" if first_error else "Model error: no healthy model available"
+            elif resolved == self.candidates[0]:
+                self._message = f"API key is valid - Using {resolved}"
+            else:
+                self._message = f"API key is valid - Using {resolved} ({self.candidates[0]} not available)"
+        self._ready.set()
+        return resolved
+
+    @property
+    def ready(self):
+        """True once the first resolution finished, so reads no longer block"""
+        return self._ready.is_set()
+
+    def _ensure_ready(self):
+        if self._ready.is_set():
+            return
+        if self._thread is None:
+            self.refresh()
+        else:
+            self._ready.wait(self.ready_timeout)
+
+    def _maybe_schedule_refresh(self):
+        if self._thread is None:
+            return
+        now = time.time()
+        if now - self._checked_at > self.ttl:
+            self._refresh_requested.set()
+        elif self._model is None:
+            # A cooldown that ran out since the last refresh may have a model back
+            with self._lock:
+                expired = any(self._checked_at < until <= now for until in self._unhealthy.values())
+            if expired:
+                self._refresh_requested.set()
+
+    def get_model(self, replaces_probe=True):
+        """Return the cached model name (or None) without a network round-trip.
+
+        ``replaces_probe`` counts the read in ``probes_avoided``; pass False
+        for lookups that never used to probe so the counter stays comparable
+        with the inline checks it replaced.
+        """
+        self._ensure_ready()
+        self._maybe_schedule_refresh()
+        with self._lock:
+            if replaces_probe:
+                self.probes_avoided += 1
+            return self._model
+
+    def status(self, replaces_probe=True):
+        """Return the cached ``(valid, message)`` health tuple (see ``get_model``)"""
+        self._ensure_ready()
+        self._maybe_schedule_refresh()
+        with self._lock:
+            if replaces_probe:
+                self.probes_avoided += 1
+            return self._valid, self._message
+
+    def mark_unhealthy(self, model_name, error=None):
+        """Demote a model after a failed real call and fail over to the next candidate"""
+        with self._lock:
+            self._unhealthy[model_name] = time.time() + self.unhealthy_cooldown
+            if self._model != model_name:
+                return
+            now = time.time()
+            fallback = next((name for name in self.candidates
+                             if self._unhealthy.get(name, 0) <= now and name not in self._probe_failed), None)
+            self._model = fallback
+            self._valid = fallback is not None
+            if fallback is None:
+                self._message = f"Model error: {error}" if error else f"Model error: {model_name} unavailable"
+            else:
+                self._message = f"API key is valid - Using {fallback} ({model_name} marked unhealthy)"
+        self._refresh_requested.set()
+
+    def stats(self):
+        """Snapshot of the registry state and probe counters"""
+        with self._lock:
+            now = time.time()
+            return {
+                'model': self._model,
+                'valid': self._valid,
+                'message': self._message,
+                'checked_at': self._checked_at,
+                'age_seconds': round(now - self._checked_at, 1) if self._checked_at else None,
+                'unhealthy': sorted(name for name, until in self._unhealthy.items() if until > now),
+                'probe_calls': self.probe_calls,
+                'probes_avoided': self.probes_avoided,
+                'refreshes': self.refreshes,
+            }
@@ -0,0 +1,165 @@
+import contextvars
+import fcntl
+import json
+import os
+import threading
+
+# Fields gathered while a request runs (cache status, model, fallback, ...)
+_request_fields = contextvars.ContextVar('query_log_fields', default=None)
+
+
+def start_request_fields():
+    """Begin collecting log fields for the current request context"""
+    fields = {}
+    return _request_fields.set(fields), fields
+
+
+def stop_request_fields(token):
+    _request_fields.reset(token)
+
+
+def annotate(**fields):
+    """Attach fields to the current request's log entry (no-op outside a request)"""
+    current = _request_fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+class QueryLogger:
+    """Append-only JSONL query log that never writes on the request path.
+
+    ``record`` only appends the entry dict to an in-memory buffer. A
+    background thread serializes and writes buffered entries every
+    ``flush_interval`` seconds, or sooner once ``batch_size`` are waiting.
+    When the file grows past ``max_bytes`` it is rotated to ``path.1``
+    (older files shift up to ``backup_count``). Writes and rotation hold an
+    ``flock`` on ``path.lock``, so several server workers can share one log
+    without interleaving lines or rotating under each other. If the writer
+    falls behind by ``max_pending`` entries, new entries are dropped and
+    counted rather than blocking requests.
+    """
+
+    def __init__(self, path, flush_interval=1.0, batch_size=256, max_bytes=50 * 1024 * 1024, backup_count=5,
+                 max_pending=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name='query-log', daemon=True)
+            self._thread.start()
+        return self
+
+    def record(self, entry):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            self.recorded += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        lines = []
+        for entry in batch:
+            try:
+                lines.append(json.dumps(entry, default=str) + "\n")
+            except (TypeError, ValueError):
+                self.errors += 1
+        with self._write_lock:
+            try:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                with open(f"{self.path}.lock", 'a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.writelines(lines)
+                        size = f.tell()
+                    self.written += len(lines)
+                    if size >= self.max_bytes:
+                        self._rotate()
+            except OSError:
+                self.errors += 1
+
+    def _rotate(self):
+        for n in range(self.backup_count - 1, 0, -1):
+            older = f"{self.path}.{n}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{n + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'path': self.path,
+            'pending': pending,
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'rotations': self.rotations,
+            'errors': self.errors,
+        }
+
+
+def read_log(path, include_rotated=True):
+    """Yield logged entries oldest first, skipping lines that are not query log entries"""
+    paths = [path]
+    if include_rotated:
+        n = 1
+        while os.path.exists(f"{path}.{n}"):
+            paths.insert(0, f"{path}.{n}")
+            n += 1
+    for name in paths:
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and 'ts' in entry and ('query' in entry or 'queries' in entry):
+                    yield entry
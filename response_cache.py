@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_query(query):
+    """Case-fold and collapse punctuation/whitespace so trivial variants share a key"""
+    return _NON_WORD.sub(' ', query.lower()).strip()
+
+
+def make_cache_key(query, retrieved_info, model_name, kind='rag'):
+    """Key on the normalized query, retrieved document versions and model.
+
+    Including each document's ``last_updated`` stamp means a knowledge base
+    update produces new keys, so stale answers are never served; the old
+    entries simply age out.
+    """
+    documents = sorted((info.get('id', info.get('title')), info.get('last_updated', ''))
+                       for info in retrieved_info or ())
+    payload = json.dumps([kind, normalize_query(query), documents, model_name])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry"""
+
+    # Lookups never wait on I/O
+    blocking = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return ``(value, status)`` where status is 'hit', 'miss' or 'expired'"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None, 'miss'
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None, 'expired'
+            self._data.move_to_end(key)
+            return value, 'hit'
+
+    def set(self, key, value, ttl):
+        """Store a value and return how many entries were evicted"""
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """Shared cache in a local SQLite file so all gunicorn workers see each other's hits"""
+
+    # Lookups hit the disk and may wait on another worker's write lock
+    blocking = True
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                expires_at REAL NOT NULL,
+                                accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, 'miss'
+        now = time.time()
+        if row[1] < now:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None, 'expired'
+        conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), 'hit'
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), now + ttl, now))
+        count = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        conn.execute("""DELETE FROM response_cache WHERE key IN (
+                            SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)""", (excess,))
+        return excess
+
+    def clear(self):
+        self._connect().execute("DELETE FROM response_cache")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+def create_cache_backend(spec, max_entries=1024):
+    """Build a backend from a spec: 'memory', 'sqlite:///path/to/cache.db' or 'off'"""
+    spec = (spec or 'memory').strip()
+    if spec == 'off':
+        return None
+    if spec == 'memory':
+        return MemoryCacheBackend(max_entries)
+    if spec.startswith('sqlite:///'):
+        return SQLiteCacheBackend(spec[len('sqlite:///'):], max_entries)
+    raise ValueError(f"Unknown cache backend: {spec}")
+
+
+class ResponseCache:
+    """LRU + TTL answer cache with hit/miss/eviction counters"""
+
+    def __init__(self, backend, ttl=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @property
+    def blocking(self):
+        """True if ``get``/``set`` can block on I/O (async callers then run them in a thread)"""
+        return getattr(self.backend, 'blocking', False)
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            value, status = self.backend.get(key)
+        except Exception:
+            status, value = 'error', None
+        with self._lock:
+            if status == 'hit':
+                self.hits += 1
+            else:
+                self.misses += 1
+                if status == 'expired':
+                    self.expirations += 1
+                elif status == 'error':
+                    self.errors += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            evicted = self.backend.set(key, value, self.ttl)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+        try:
+            stats['entries'] = len(self.backend) if self.backend else 0
+        except Exception:
+            stats['entries'] = None
+        return stats
@@ -0,0 +1,318 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from get had has have how i if in is it
+its me my of on or our should so that the their there this to us was we were what
+when where which who why will with you your any about tell
+""".split())
+
+
+def _stem(token):
+    """Very light plural folding so 'reviews' matches 'review'"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text, keep_stopwords=False):
+    """Lowercase, split on non-alphanumerics and fold plurals"""
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) > 1]
+    if not keep_stopwords:
+        tokens = [t for t in tokens if t not in STOPWORDS]
+    return [_stem(t) for t in tokens]
+
+
+class _TermScores:
+    """Precomputed BM25 contributions of one term, as NumPy arrays.
+
+    ``docs``/``weights`` are ordered by document ordinal for lookups;
+    ``best_docs`` holds the highest-weight documents, best first, for pruning.
+    """
+
+    __slots__ = ('docs', 'weights', 'best_docs', 'upper_bound')
+
+    def __init__(self, docs, weights, best_docs, upper_bound):
+        self.docs, self.weights = docs, weights
+        self.best_docs = best_docs
+        self.upper_bound = upper_bound
+
+    @classmethod
+    def from_arrays(cls, docs, weights):
+        order = np.argsort(docs)
+        best = np.argsort(-weights, kind='stable')
+        return cls(docs[order], weights[order], docs[best], float(weights[best[0]]))
+
+    def best(self, k):
+        """The ``k`` highest-weight documents (any order past the stored ones)"""
+        if k <= len(self.best_docs) or len(self.best_docs) == len(self.docs):
+            return self.best_docs[:k]
+        return self.docs[np.argpartition(-self.weights, k - 1)[:k]]
+
+    def lookup(self, docs):
+        """Contribution of this term to each of ``docs`` (sorted ordinals)"""
+        pos = np.minimum(np.searchsorted(self.docs, docs), len(self.docs) - 1)
+        return np.where(self.docs[pos] == docs, self.weights[pos], 0.0)
+
+
+class _CompiledIndex:
+    """Read-only scoring view of a ``BM25Index`` at one point in time.
+
+    All postings are laid out once as flat arrays sliced per term (ordered
+    by document ordinal, which follows insertion order so ties rank
+    stably), with the ``best_depth`` highest weights of each term kept
+    separately for pruning.
+    """
+
+    best_depth = 16
+
+    def __init__(self, index):
+        self.doc_ids = list(index._doc_len)
+        self.ordinals = ordinals = {doc_id: n for n, doc_id in enumerate(self.doc_ids)}
+        n_docs = len(self.doc_ids)
+        lengths = np.fromiter(index._doc_len.values(), dtype=np.float64, count=n_docs)
+        avg_len = index._total_len / n_docs if n_docs else 1.0
+        norms = index.k1 * (1 - index.b + index.b * lengths / avg_len)
+        self.n_docs = n_docs
+
+        postings = [(term, p) for term, p in index._postings.items() if p]
+        self.term_ids = {term: n for n, (term, _) in enumerate(postings)}
+        counts = np.fromiter((len(p) for _, p in postings), dtype=np.int64, count=len(postings))
+        total = int(counts.sum())
+        docs = np.fromiter((ordinals[doc_id] for _, p in postings for doc_id in p), dtype=np.int32, count=total)
+        tf = np.fromiter((tf for _, p in postings for tf in p.values()), dtype=np.float64, count=total)
+        term_of = np.repeat(np.arange(len(postings)), counts)
+        idf = np.log1p((n_docs - counts + 0.5) / (counts + 0.5))
+        weights = idf[term_of] * tf * (index.k1 + 1) / (tf + norms[docs])
+
+        order = np.lexsort((docs, term_of))
+        self.docs, self.weights = docs[order], weights[order]
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        starts = self.offsets[:-1]
+        self.upper_bounds = np.maximum.reduceat(weights, starts) if total else np.zeros(0)
+
+        order = np.lexsort((-weights, term_of))
+        keep = np.arange(total) - starts[term_of] < self.best_depth
+        self.best_docs = docs[order][keep]
+        self.best_offsets = np.concatenate(([0], np.cumsum(np.minimum(counts, self.best_depth))))
+
+    def term(self, term):
+        n = self.term_ids.get(term)
+        if n is None:
+            return None
+        start, end = self.offsets[n], self.offsets[n + 1]
+        return _TermScores(self.docs[start:end], self.weights[start:end],
+                           self.best_docs[self.best_offsets[n]:self.best_offsets[n + 1]],
+                           float(self.upper_bounds[n]))
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring.
+
+    Documents are tokenized once when added. Postings map each term to the
+    term frequency per document, so a query only touches the postings of
+    its own terms. Synonym phrases (e.g. "pto" or "how many people") are
+    kept in a separate phrase table and add a fixed boost when the phrase
+    appears in the query as whole tokens.
+
+    For scoring, the postings are laid out as NumPy arrays of precomputed
+    BM25 weights (idf and length norm folded in), and ``search`` prunes
+    MaxScore-style: documents that cannot reach the current k-th best score
+    are never scored. The arrays are rebuilt after the index changes, on
+    the next query or ahead of time with ``compile``.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, title_weight=3, synonym_boost=3.0):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.synonym_boost = synonym_boost
+
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_len = {}
+        self._total_len = 0
+
+        self._phrases = defaultdict(set)
+        self._doc_phrases = defaultdict(set)
+        self._max_phrase_len = 1
+
+        self._compiled = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_compiled', None)
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_len
+
+    def copy(self):
+        """Return an independent copy that can be updated while this one serves reads"""
+        clone = BM25Index(self.k1, self.b, self.title_weight, self.synonym_boost)
+        clone._postings = defaultdict(dict, ((term, dict(p)) for term, p in self._postings.items()))
+        clone._doc_terms = dict(self._doc_terms)
+        clone._doc_len = dict(self._doc_len)
+        clone._total_len = self._total_len
+        clone._phrases = defaultdict(set, ((key, set(docs)) for key, docs in self._phrases.items()))
+        clone._doc_phrases = defaultdict(set, ((doc, set(keys)) for doc, keys in self._doc_phrases.items()))
+        clone._max_phrase_len = self._max_phrase_len
+        return clone
+
+    def add(self, doc_id, text, title=''):
+        """Index (or re-index) a document"""
+        if doc_id in self._doc_len:
+            self._remove_terms(doc_id)
+        self._compiled = None
+
+        terms = Counter(tokenize(text))
+        for term in tokenize(title):
+            terms[term] += self.title_weight
+
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+
+    def add_synonyms(self, doc_id, phrases):
+        """Register phrases that should boost ``doc_id`` when they occur in a query"""
+        for phrase in phrases:
+            key = tuple(tokenize(phrase, keep_stopwords=True))
+            if not key:
+                continue
+            self._phrases[key].add(doc_id)
+            self._doc_phrases[doc_id].add(key)
+            self._max_phrase_len = max(self._max_phrase_len, len(key))
+
+    def remove(self, doc_id):
+        """Drop a document and its synonym phrases from the index"""
+        if doc_id in self._doc_len:
+            self._remove_terms(doc_id)
+        for key in self._doc_phrases.pop(doc_id, ()):
+            docs = self._phrases.get(key)
+            if docs is not None:
+                docs.discard(doc_id)
+                if not docs:
+                    del self._phrases[key]
+
+    def _remove_terms(self, doc_id):
+        self._compiled = None
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def _view(self):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = _CompiledIndex(self)
+        return compiled
+
+    def compile(self):
+        """Build the scoring arrays now rather than on the first query"""
+        self._view()
+        return self
+
+    def _phrase_boosts(self, query, ordinals):
+        """``{ordinal: boost}`` for synonym phrases occurring in the query (indexed documents only)"""
+        boosts = defaultdict(float)
+        if self._phrases:
+            raw = tokenize(query, keep_stopwords=True)
+            seen = set()
+            for n in range(1, self._max_phrase_len + 1):
+                for i in range(len(raw) - n + 1):
+                    key = tuple(raw[i:i + n])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    for doc_id in self._phrases.get(key, ()):
+                        if doc_id in ordinals:
+                            boosts[ordinals[doc_id]] += self.synonym_boost
+        return boosts
+
+    def _query(self, query):
+        """The compiled view and the query's term scores; synonym boosts count as one more term"""
+        view = self._view()
+        terms = [scores for scores in (view.term(term) for term in set(tokenize(query))) if scores is not None]
+        boosts = self._phrase_boosts(query, view.ordinals)
+        if boosts:
+            terms.append(_TermScores.from_arrays(np.fromiter(boosts.keys(), dtype=np.int64, count=len(boosts)),
+                                                 np.fromiter(boosts.values(), dtype=np.float64, count=len(boosts))))
+        return view, terms
+
+    def score(self, query):
+        """Return ``{doc_id: score}`` for every document matching the query"""
+        view, terms = self._query(query)
+        scores = np.zeros(view.n_docs, dtype=np.float64)
+        for term in terms:
+            scores[term.docs] += term.weights
+        docs = np.flatnonzero(scores)
+        doc_ids = view.doc_ids
+        return {doc_ids[doc]: score for doc, score in zip(docs.tolist(), scores[docs].tolist())}
+
+    def search(self, query, k=5, min_score_ratio=0.0):
+        """Return the top ``k`` ``(doc_id, score)`` pairs, best first.
+
+        Results scoring below ``min_score_ratio`` times the best score are
+        dropped, which trims weak single-term matches from the tail.
+        """
+        view, terms = self._query(query)
+        if k <= 0 or not terms:
+            return []
+
+        # Lower bound for the k-th best score, from each term's best documents
+        seeds = np.unique(np.concatenate([term.best(k) for term in terms]))
+        threshold = 0.0
+        if len(seeds) >= k:
+            seed_scores = sum(term.lookup(seeds) for term in terms)
+            threshold = np.partition(seed_scores, len(seeds) - k)[len(seeds) - k] * (1 - 1e-9)
+
+        # MaxScore: the low-impact terms whose upper bounds together stay below
+        # the threshold cannot put a document in the top k on their own, so
+        # their postings are only looked up for documents the others matched
+        terms.sort(key=lambda term: term.upper_bound)
+        optional, bound = 0, 0.0
+        while optional < len(terms) - 1 and bound + terms[optional].upper_bound < threshold:
+            bound += terms[optional].upper_bound
+            optional += 1
+
+        scores = np.zeros(view.n_docs, dtype=np.float64)
+        for term in terms[optional:]:
+            scores[term.docs] += term.weights
+        docs = np.flatnonzero(scores + bound >= threshold) if optional else np.flatnonzero(scores)
+        # Binary-search short candidate lists; scatter a term whose postings are cheaper to add whole
+        lookups = []
+        for term in terms[:optional]:
+            if len(term.docs) <= 8 * len(docs):
+                scores[term.docs] += term.weights
+            else:
+                lookups.append(term)
+        scores = scores[docs]
+        for term in lookups:
+            scores += term.lookup(docs)
+
+        if len(docs) > k:
+            keep = scores >= np.partition(scores, len(docs) - k)[len(docs) - k]
+            docs, scores = docs[keep], scores[keep]
+        order = np.lexsort((docs, -scores))[:k]
+        doc_ids = view.doc_ids
+        top = [(doc_ids[doc], score) for doc, score in zip(docs[order].tolist(), scores[order].tolist())]
+        if top and min_score_ratio:
+            cutoff = top[0][1] * min_score_ratio
+            top = [item for item in top if item[1] >= cutoff]
+        return top
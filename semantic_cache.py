@@ -0,0 +1,131 @@
+import threading
+import time
+
+import numpy as np
+
+from dense_retrieval import HashingEmbedder
+from retrieval import tokenize
+
+
+def document_set_key(retrieved_info, model_name):
+    """Identity of the retrieved documents (with versions) plus the model"""
+    documents = tuple(sorted((info.get('id', info.get('title')), info.get('last_updated', ''))
+                             for info in retrieved_info or ()))
+    return documents, model_name
+
+
+class SemanticCache:
+    """Near-duplicate query cache backed by a fixed-size embedding matrix.
+
+    Past queries are embedded locally into a preallocated float32 matrix.
+    A lookup is one matrix-vector product over the occupied rows; the best
+    row above ``threshold`` is reused only if it was answered from the same
+    retrieved document set and model, and its query has the same content
+    words (stopwords dropped, plurals folded). Similar wording alone is not
+    enough: "deductible for families" and "deductible for individuals"
+    embed close together but need different answers. When full, the least
+    recently used row is overwritten. Rows expire ``ttl`` seconds after they
+    were added, like the exact response cache.
+
+    The embedder should be fitted on the knowledge base (word n-grams,
+    unseen words dropped) so that similarity is driven by the terms that
+    decide retrieval rather than by filler words.
+    """
+
+    def __init__(self, capacity=2048, threshold=0.8, dim=2048, embedder=None, ttl=None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embedder = embedder or HashingEmbedder(dim, char_ngrams=False)
+        self._matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._entries = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._expires = np.full(capacity, np.inf, dtype=np.float64)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.resets = 0
+
+    def __len__(self):
+        return self._size
+
+    def lookup(self, query, retrieved_info, model_name):
+        """Return a cached answer for a similar query over the same documents, or None"""
+        embedder = self.embedder
+        vector = embedder.embed(query)
+        key = document_set_key(retrieved_info, model_name)
+        words = frozenset(tokenize(query))
+        with self._lock:
+            self.lookups += 1
+            if not self._size or not vector.any() or embedder is not self.embedder:
+                return None
+            scores = self._matrix[:self._size] @ vector
+            now = time.monotonic()
+            for row in np.argsort(-scores):
+                if scores[row] < self.threshold:
+                    break
+                entry = self._entries[row]
+                if entry[0] == key and entry[2] == words:
+                    if self._expires[row] <= now:
+                        self.expirations += 1
+                        continue
+                    self._last_used[row] = time.monotonic()
+                    self.hits += 1
+                    return entry[1]
+        return None
+
+    def add(self, query, retrieved_info, model_name, answer):
+        """Remember an answer, evicting the least recently used entry when full"""
+        embedder = self.embedder
+        vector = embedder.embed(query)
+        if not vector.any():
+            return
+        key = document_set_key(retrieved_info, model_name)
+        with self._lock:
+            if embedder is not self.embedder:
+                return
+            now = time.monotonic()
+            if self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                # Expired rows are reused first, then the least recently used one
+                row = int(np.argmin(np.where(self._expires <= now, -np.inf, self._last_used)))
+                if self._expires[row] > now:
+                    self.evictions += 1
+            self._matrix[row] = vector
+            self._entries[row] = (key, answer, frozenset(tokenize(query)))
+            self._last_used[row] = now
+            self._expires[row] = now + self.ttl if self.ttl else np.inf
+
+    def reset(self, embedder=None):
+        """Drop every entry, optionally switching to a newly fitted embedder"""
+        with self._lock:
+            if embedder is not None:
+                self.embedder = embedder
+                self._matrix = np.zeros((self.capacity, embedder.dim), dtype=np.float32)
+            else:
+                self._matrix[:] = 0
+            self._entries = [None] * self.capacity
+            self._last_used[:] = 0
+            self._expires[:] = np.inf
+            self._size = 0
+            self.resets += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': self._size,
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'llm_calls_saved': self.hits,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'resets': self.resets,
+            }
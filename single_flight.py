@@ -0,0 +1,237 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FileResultStore:
+    """Cross-process single flight through lock files and result files in a local directory.
+
+    The worker that takes a key's ``flock`` runs the call and writes the
+    result next to the lock before releasing it. Workers that find the lock
+    taken block on it, then read that result instead of calling upstream.
+    Only results written after a follower started waiting are accepted, so
+    an older answer for the same key is never reused here (that is the
+    response cache's job). Failed calls write nothing; followers then run
+    the call themselves.
+    """
+
+    def __init__(self, directory, result_ttl=60):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+    def _read(self, path, not_before):
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('written_at', 0) >= not_before else None
+
+    def _write(self, path, result):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'written_at': time.time(), 'result': result}, f)
+        os.replace(tmp, path + '.json')
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        # Removing a lock file someone is about to open can at worst cost one
+        # duplicate upstream call, never a wrong answer
+        cutoff = time.time() - self.result_ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if name.endswith('.lock'):
+                    fd = os.open(path, os.O_RDWR)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.remove(path)
+                    finally:
+                        os.close(fd)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def run(self, key, wait_timeout, func, *args):
+        """Return ``(result, shared)``; ``shared`` is True if another worker produced it"""
+        path = self._path(key)
+        fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waiting_since = time.time()
+                expires = time.monotonic() + wait_timeout
+                while True:
+                    time.sleep(0.02)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= expires:
+                            return func(*args), False
+                entry = self._read(path, waiting_since)
+                if entry is not None:
+                    return entry['result'], True
+
+            result = func(*args)
+            self._write(path, result)
+            return result, False
+        finally:
+            os.close(fd)
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls so only one reaches upstream.
+
+    The first caller for a key runs the call; callers arriving while it is
+    in flight wait (up to ``wait_timeout`` seconds, or their own ``timeout``
+    if shorter) and share its result or exception. Exceptions listed in
+    ``private_errors`` describe the leader's own call (e.g. its deadline)
+    rather than the shared work, so waiters run the call themselves with
+    their own arguments instead. With a ``FileResultStore`` the leader also
+    coordinates with other worker processes on the same host.
+    """
+
+    def __init__(self, store=None, wait_timeout=30, private_errors=()):
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self.private_errors = tuple(private_errors)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.coalesced_cross_worker = 0
+        self.wait_timeouts = 0
+
+    def do(self, key, func, *args, timeout=None):
+        """Return ``(result, shared)`` for ``func(*args)``, sharing in-flight calls per key.
+
+        ``timeout`` caps how long this caller waits for someone else's call.
+        """
+        wait_timeout = self.wait_timeout if timeout is None else max(0.0, min(self.wait_timeout, timeout))
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+
+        if not leader:
+            if not call.event.wait(wait_timeout):
+                with self._lock:
+                    self.wait_timeouts += 1
+                return func(*args), False
+            if isinstance(call.error, self.private_errors):
+                return func(*args), False
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            if self.store is not None:
+                call.result, shared = self.store.run(key, wait_timeout, func, *args)
+                if shared:
+                    with self._lock:
+                        self.coalesced_cross_worker += 1
+            else:
+                call.result, shared = func(*args), False
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesced_cross_worker': self.coalesced_cross_worker,
+                'upstream_calls_saved': self.coalesced + self.coalesced_cross_worker,
+                'wait_timeouts': self.wait_timeouts,
+                'shared_store': self.store.directory if self.store is not None else None,
+            }
+
+
+class AsyncSingleFlight:
+    """Event-loop variant of ``SingleFlight`` for the async serving mode.
+
+    The shared call runs as its own task; each caller awaits it through
+    ``asyncio.shield``, for at most its own ``timeout``. If every caller
+    gives up (deadline or disconnect), the task is cancelled so it stops
+    holding an upstream slot. As in ``SingleFlight``, waiters run the call
+    themselves when the shared task fails with one of ``private_errors``.
+    """
+
+    def __init__(self, private_errors=()):
+        self.private_errors = tuple(private_errors)
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func, *args, timeout=None):
+        entry = self._calls.get(key)
+        shared = entry is not None
+        if not shared:
+            entry = self._calls[key] = [asyncio.ensure_future(func(*args)), 0]
+            self.leaders += 1
+            entry[0].add_done_callback(lambda _: self._calls.pop(key, None) if self._calls.get(key) is entry else None)
+
+        entry[1] += 1
+        try:
+            if not shared:
+                return await asyncio.shield(entry[0]), False
+            try:
+                result = await asyncio.wait_for(asyncio.shield(entry[0]), timeout)
+            except Exception as e:
+                # Still running past our own timeout, or failed for the leader's own reasons
+                if entry[0].done() and not isinstance(e, self.private_errors):
+                    self.coalesced += 1
+                    raise
+            else:
+                self.coalesced += 1
+                return result, True
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not entry[0].done():
+                entry[0].cancel()
+        return await func(*args), False
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'upstream_calls_saved': self.coalesced,
+        }